@@ -1,16 +1,17 @@
 import streamlit as st
+import base64
 import time
 import random
 import string
 
 # --- OUR NEW MODULES ---
 from weather_utils import draw_weather_dashboard
-from poster_engine import create_poster, get_album_from_track
+from poster_engine import render_for_track, fallback_poster, choose_format, choose_resolution
+from render_service import render_service, PRIORITY_LIVE, PRIORITY_LAYOUT
+from venue_hub import get_venue_hub
 from cloud_utils import (
-    get_current_song_from_cloud, log_manual_history, 
-    init_pairing_code, check_pairing_status, 
-    check_if_unpaired, unpair_from_cloud, check_subscription_status,
-    get_display_layout, get_venue_settings
+    log_manual_history, init_pairing_code, check_pairing_status, 
+    unpair_from_cloud
 )
 
 # --- PAGE SETUP & KIOSK MODE CSS ---
@@ -56,6 +57,17 @@ hide_st_style = """
                 background-color: #000000 !important;
                 z-index: 1 !important;
             }
+            /* WebP/AVIF posters are inlined (st.image would re-encode them to JPEG) */
+            .poster-img {
+                position: fixed !important;
+                top: 0px !important;
+                left: 0px !important;
+                width: 100vw !important;
+                height: 100vh !important;
+                object-fit: contain !important;
+                background-color: #000000 !important;
+                z-index: 1 !important;
+            }
             [data-testid="stImage"] img {
                 object-fit: contain !important; 
                 width: 100% !important;
@@ -75,6 +87,41 @@ def clear_connection():
     if "venue_id" in st.query_params: del st.query_params["venue_id"]
     if "display_id" in st.query_params: del st.query_params["display_id"]
 
+# --- ⚡️ CLIENT HINTS ⚡️ ---
+# Only the browser knows how fast its link is and how many pixels its screen has. Once
+# per load, a tiny script writes both into the URL next to venue_id/display_id and
+# reloads, so Python can read them.
+def report_client_hints():
+    if "mbps" in st.query_params and "screen" in st.query_params: return
+    st.html("""<script>
+        const url = new URL(window.location.href);
+        if (!url.searchParams.has("mbps") || !url.searchParams.has("screen")) {
+            const link = navigator.connection; // Chromium only - anything else reports 0 = unknown
+            const ratio = window.devicePixelRatio || 1; // CSS pixels -> the panel's real pixels
+            url.searchParams.set("mbps", link && link.downlink ? link.downlink : 0);
+            url.searchParams.set("screen", Math.round(window.innerWidth * ratio) + "x" + Math.round(window.innerHeight * ratio));
+            window.location.replace(url);
+        }
+    </script>""", unsafe_allow_javascript=True)
+
+def get_link_mbps():
+    try: return float(st.query_params.get("mbps", 0)) or None
+    except ValueError: return None
+
+def get_screen_size():
+    try:
+        w, h = st.query_params.get("screen", "").lower().split("x")
+        return int(w), int(h)
+    except ValueError: return None, None
+
+def show_poster(poster):
+    if poster.mimetype in ("image/jpeg", "image/png"):
+        # Already-encoded bytes at their own width: st.image neither resizes nor re-encodes them
+        st.image(poster.data, width=poster.width)
+    else:
+        encoded = base64.b64encode(poster.data).decode("ascii")
+        st.markdown(f"<img class='poster-img' src='data:{poster.mimetype};base64,{encoded}'>", unsafe_allow_html=True)
+
 # --- INIT SESSION STATE ---
 if 'last_track' not in st.session_state: st.session_state.last_track = None
 if 'last_timestamp' not in st.session_state: st.session_state.last_timestamp = 0
@@ -82,6 +129,9 @@ if 'current_poster' not in st.session_state: st.session_state.current_poster = N
 if 'last_heard_time' not in st.session_state: st.session_state.last_heard_time = time.time()
 if 'is_standby' not in st.session_state: st.session_state.is_standby = False
 if 'last_orientation' not in st.session_state: st.session_state.last_orientation = "Landscape"
+if 'last_format' not in st.session_state: st.session_state.last_format = None
+if 'render_job' not in st.session_state: st.session_state.render_job = None
+if 'retry_render_at' not in st.session_state: st.session_state.retry_render_at = None
 
 # --- GLOBAL SETTINGS STATE ---
 if 'venue_city' not in st.session_state: st.session_state.venue_city = "London"
@@ -123,9 +173,10 @@ if not current_venue_id or not current_display_id:
     st.rerun() 
 
 else:
-    is_pro = check_subscription_status(current_venue_id)
+    snapshot = get_venue_hub(current_venue_id, current_display_id, standby=st.session_state.is_standby).snapshot(current_display_id)
     
-    if not is_pro:
+    # ok=False = no answer from the cloud yet (or an error): not the same as "not Pro"
+    if snapshot.ok and not snapshot.is_pro:
         st.markdown("""
             <div style='display: flex; flex-direction: column; justify-content: center; align-items: center; height: 100vh; background-color: #000; color: #FFF; font-family: sans-serif; text-align: center; padding: 50px;'>
                 <h1 style='font-size: 4rem; margin-bottom: 20px; font-weight: 900;'><span style='color: #FFF;'>SOUND</span><span style='color: #7C3AED;'>SCREEN</span></h1>
@@ -141,25 +192,74 @@ else:
 
     else:
         # ✅ DUMB GLASS MODE ✅
+        report_client_hints()
         if st.session_state.is_standby:
             draw_weather_dashboard(st.session_state.venue_city, st.session_state.last_orientation)
         elif st.session_state.current_poster:
-            st.image(st.session_state.current_poster.convert('RGB'), use_container_width=True, output_format="JPEG")
+            show_poster(st.session_state.current_poster)
         else:
             st.markdown(f"<h3 style='color:gray;text-align:center;margin-top:200px;'>Listening to Venue Cloud...<br><span style='font-size:12px;opacity:0.5;'>Venue: {current_venue_id}<br>Display: {current_display_id}</span></h3>", unsafe_allow_html=True)
 
-        @st.fragment(run_every=1)
+        # ⚡️ Every display of this venue in this process shares one hub: now playing is
+        # pushed over its stream, and plan, settings and every display's pairing + layout
+        # come from one poll. So the fragment can tick fast and only read memory.
+        # The tick only reads memory, but in standby it needn't be snappy either. (Going in or
+        # out of standby is always a full rerun, which re-reads this.)
+        @st.fragment(run_every=2 if st.session_state.is_standby else 0.5)
         def background_listener():
             needs_rerun = False
+
+            # 1. Pick up a poster that finished rendering since the last tick
+            job = st.session_state.render_job
+            if job and job.done():
+                st.session_state.render_job = None
+                new_poster = job.result()
+                if new_poster:
+                    job_track, _, job_layout, job_format, _ = job.key
+                    st.session_state.current_poster = new_poster
+                    st.session_state.last_track = job_track
+                    st.session_state.last_orientation = job_layout
+                    st.session_state.last_format = job_format
+                    st.session_state.is_standby = False
+                    # Cover-less fallback? Then it says when the real poster is worth another try
+                    st.session_state.retry_render_at = new_poster.retry_at
+                    needs_rerun = True
+            elif job and job.expired:
+                # Stop waiting: show the cover-less card and leave the real poster for later
+                # (resubmitting right away would just pile onto the stuck render)
+                st.session_state.render_job = None
+                render_service.give_up(job)
+                job_track, job_artist, job_layout, job_format, job_resolution = job.key
+                retry_at = time.time() + render_service.job_timeout
+                st.session_state.current_poster = fallback_poster(job_track, job_artist, job_layout, job_format, job_resolution, retry_at)
+                st.session_state.last_track = job_track
+                st.session_state.last_orientation = job_layout
+                st.session_state.last_format = job_format
+                st.session_state.is_standby = False
+                st.session_state.retry_render_at = retry_at
+                needs_rerun = True
+            elif job and job.preview is not None and st.session_state.current_poster is not job.preview:
+                # Phase one of a cold render: cover over blur until the finished poster swaps in
+                st.session_state.current_poster = job.preview
+                st.session_state.is_standby = False
+                needs_rerun = True
             
-            if check_if_unpaired(current_venue_id, current_display_id):
+            # Also renews this display's lease, and tells the hub whether we're dozing on the weather
+            hub = get_venue_hub(current_venue_id, current_display_id, standby=st.session_state.is_standby)
+            snapshot = hub.snapshot(current_display_id)
+            if not snapshot.ok: # Nothing trustworthy to act on this tick - keep showing what we have
+                if needs_rerun: st.rerun()
+                return
+
+            if not snapshot.paired:
+                hub.release(current_display_id)
                 clear_connection()
                 st.rerun()
 
-            if not check_subscription_status(current_venue_id):
+            if not snapshot.is_pro:
                 st.rerun()
 
-            cloud_city, cloud_timeout = get_venue_settings(current_venue_id)
+            cloud_city, cloud_timeout = snapshot.city, snapshot.timeout
             
             if cloud_city != st.session_state.venue_city or cloud_timeout != st.session_state.venue_timeout:
                 st.session_state.venue_city = cloud_city
@@ -167,15 +267,18 @@ else:
                 if st.session_state.is_standby:
                     needs_rerun = True
 
-            current_layout = get_display_layout(current_venue_id, current_display_id)
+            current_layout = snapshot.layout
             if current_layout not in ["Landscape", "Portrait", "Portrait (Sideways TV)"]:
                 current_layout = "Landscape"
 
-            track_found, artist_found, timestamp_found = get_current_song_from_cloud(current_venue_id)
+            track_found, artist_found, timestamp_found = snapshot.track, snapshot.artist, snapshot.timestamp
             
             if track_found and artist_found:
                 song_changed = (track_found != st.session_state.last_track)
                 layout_changed = (current_layout != st.session_state.last_orientation)
+                poster_format = choose_format(snapshot.format, get_link_mbps())
+                poster_resolution = choose_resolution(*get_screen_size(), current_layout) # Only changes with the layout
+                format_changed = (poster_format != st.session_state.last_format)
                 time_changed = (timestamp_found != st.session_state.last_timestamp)
                 
                 # ⚡️ THE FIX: Only reset the timer if a brand new push hit the cloud! ⚡️
@@ -184,22 +287,23 @@ else:
                     st.session_state.last_timestamp = timestamp_found
                 
                 # Wake up and draw if it's a new song, a new layout, or if the screen was asleep and they pushed the same song again
-                if song_changed or layout_changed or (time_changed and st.session_state.is_standby):
-                    if layout_changed:
-                        st.toast(f"Cloud Sync: Screen is now {current_layout} 📲", icon="🔄")
-                        st.cache_data.clear() 
-
-                    album_found = get_album_from_track(track_found, artist_found)
-                    if album_found:
-                        new_poster = create_poster(album_found, artist_found, current_layout)
-                        
-                        if new_poster:
-                            st.session_state.current_poster = new_poster
-                            st.session_state.last_track = track_found
-                            st.session_state.last_orientation = current_layout
-                            st.session_state.is_standby = False
-                                
-                    needs_rerun = True
+                # The old poster stays up while the new one renders off-thread
+                # (same key from another TV in the venue = the same job, rendered once)
+                wanted = (track_found, artist_found, current_layout, poster_format, poster_resolution)
+                pending = st.session_state.render_job
+                retry_due = st.session_state.retry_render_at is not None and time.time() >= st.session_state.retry_render_at
+                if song_changed or layout_changed or format_changed or retry_due or (time_changed and st.session_state.is_standby):
+                    if pending is None or pending.key != wanted:
+                        priority = PRIORITY_LIVE if song_changed or st.session_state.is_standby else PRIORITY_LAYOUT
+                        new_job = render_service.submit(
+                            wanted, render_for_track, track_found, artist_found, current_layout,
+                            priority=priority, owner=current_display_id, venue_id=current_venue_id,
+                            fmt=poster_format, resolution=poster_resolution,
+                        )
+                        if new_job:
+                            if layout_changed:
+                                st.toast(f"Cloud Sync: Screen is now {current_layout} 📲", icon="🔄")
+                            st.session_state.render_job = new_job
 
             # 3. Dynamic Timeout Countdown
             time_since_last_song = time.time() - st.session_state.last_heard_time
@@ -0,0 +1,60 @@
+import json
+import os
+
+from poster_cache import DiskCache, make_key
+
+# --- ⚡️ PERSISTENT SPOTIFY ASSET STORE ⚡️ ---
+# Cover art, the Spotify code and the album's metadata never change for a given album
+# URI, so after the first fetch we keep them on disk. A restart, or the same album in a
+# new orientation, then renders with zero network calls. Images are read through a memory
+# map, straight out of the OS page cache (which keeps the hot covers in RAM), and the map is
+# closed as soon as the bytes are out. Eviction is least-recently-used within a byte budget.
+
+ASSET_STORE_DIR = os.environ.get("ASSET_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".asset_store"))
+ASSET_STORE_MAX_BYTES = int(os.environ.get("ASSET_STORE_MAX_MB", 256)) * 1024 * 1024
+
+
+class AssetStore:
+    def __init__(self, directory=ASSET_STORE_DIR, max_bytes=ASSET_STORE_MAX_BYTES):
+        self.blobs = DiskCache(directory, max_bytes, suffix=".asset")
+
+    def get(self, uri):
+        """The asset record for an album URI (cover/code as bytes), or None."""
+        meta = self.blobs.get(make_key(uri, "meta"))
+        if meta is None: return None
+        record = json.loads(meta)
+        record["cover_bytes"] = self.blobs.get_mapped(make_key(uri, "cover"))
+        record["code_bytes"] = self.blobs.get_mapped(make_key(uri, "code")) if record.pop("has_code", False) else None
+        if record["cover_bytes"] is None: return None # Half-evicted, treat as a miss
+        return record
+
+    def put(self, uri, record):
+        meta = self._meta(record)
+        # Images first, metadata last: a reader that finds the metadata will find the images
+        self.blobs.put(make_key(uri, "cover"), bytes(record["cover_bytes"]))
+        if meta["has_code"]: self.blobs.put(make_key(uri, "code"), bytes(record["code_bytes"]))
+        self.blobs.put(make_key(uri, "meta"), json.dumps(meta).encode("utf-8"))
+
+    def put_meta(self, uri, record):
+        """Rewrites just the metadata of a stored album (the images stay where they are)."""
+        self.blobs.put(make_key(uri, "meta"), json.dumps(self._meta(record)).encode("utf-8"))
+
+    @staticmethod
+    def _meta(record):
+        meta = {k: v for k, v in record.items() if k not in ("cover_bytes", "code_bytes")}
+        meta["has_code"] = bool(record.get("code_bytes"))
+        return meta
+
+    # The renderer still asks by (album name, artist), so remember which URI that meant
+    def lookup_alias(self, album_name, artist_name):
+        uri = self.blobs.get(make_key("alias", album_name, artist_name))
+        return uri.decode("utf-8") if uri else None
+
+    def add_alias(self, album_name, artist_name, uri):
+        self.blobs.put(make_key("alias", album_name, artist_name), uri.encode("utf-8"))
+
+    def stats(self):
+        return self.blobs.stats()
+
+
+asset_store = AssetStore()
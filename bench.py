@@ -0,0 +1,374 @@
+"""Quick performance checks for the display pipeline.
+
+    python bench.py subscription     # per-poll cloud cost vs. size of the venue's history
+    python bench.py stream           # live now_playing push latency, and the event-stream protocol against a fake
+    python bench.py formats          # poster encode time + bytes per output format
+    python bench.py codemask         # Spotify code overlay: old per-pixel loop vs. NumPy vs. cache hit
+    python bench.py textlayout       # track list truncation + title wrapping on long titles, old vs. new
+    python bench.py backdrop         # blurred background per quality tier, first render vs. cache hit
+    python bench.py palette          # colour bar: old LANCZOS crops per render vs. the once-per-album palette
+
+Poster benches use the cover art at $BENCH_COVER (any album JPEG) and fall back to a
+synthetic image, which compresses unrealistically well. $BENCH_CODE can point at a real
+Spotify code PNG the same way.
+
+Everything runs against local fakes, so no Firebase or Spotify credentials are needed.
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# --- LOCAL FAKE FIREBASE (REST reads + event streams) ---
+def start_fake_firebase(db, keep_alive=30):
+    """Serves `db` like the Firebase REST API (GET <path>.json) on a random local port.
+
+    A GET with "Accept: text/event-stream" gets Firebase's streaming protocol instead: a put
+    of the whole node, then whatever stream_event() sends, with a keep-alive every
+    `keep_alive` seconds in between. drop_streams() cuts every open stream, and while
+    server.refuse_streams is set new ones get a 503 (so the client has to poll).
+    """
+    import queue
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+        def log_message(self, *args): pass
+
+        def do_GET(self):
+            node = db
+            for key in [k for k in self.path.split("?")[0].removesuffix(".json").split("/") if k]:
+                node = node.get(key) if isinstance(node, dict) else None
+            if "text/event-stream" in self.headers.get("Accept", ""): return self.stream(node)
+            body = json.dumps(node).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def stream(self, node):
+            if server.refuse_streams:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close") # No length: the body runs until we hang up
+            self.end_headers()
+            events = queue.Queue()
+            events.put(("put", {"path": "/", "data": node}))
+            with server.streams_lock: server.streams.append(events)
+            try:
+                while True:
+                    try: item = events.get(timeout=keep_alive)
+                    except queue.Empty: item = ("keep-alive", None)
+                    if item is None: # drop_streams(): hang up without a goodbye, like a dead network
+                        self.connection.shutdown(socket.SHUT_RDWR)
+                        return
+                    self.wfile.write(f"event: {item[0]}\ndata: {json.dumps(item[1])}\n\n".encode())
+                    self.wfile.flush()
+            except OSError: pass
+            finally:
+                with server.streams_lock: server.streams.remove(events)
+                self.close_connection = True
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.streams, server.streams_lock, server.refuse_streams = [], threading.Lock(), False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def stream_event(server, event, payload):
+    """Sends one event (put, patch, keep-alive, cancel...) down every open stream."""
+    with server.streams_lock:
+        for events in server.streams: events.put((event, payload))
+
+def drop_streams(server):
+    with server.streams_lock:
+        for events in server.streams: events.put(None)
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline: return False
+        time.sleep(0.01)
+    return True
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+# --- SUBSCRIPTION / TICK COST vs. HISTORY SIZE ---
+def bench_subscription(repeat=5):
+    import cloud_utils
+    from http_utils import http_get
+    from venue_hub import VenueHub
+
+    print(f"{'history':>8} | {'old isPro (whole venue)':>24} | {'isPro leaf':>10} | {'hub poll (all displays)':>23}")
+    for size in (0, 1_000, 10_000, 100_000):
+        history = {str(i): {"id": str(i), "track": f"Track {i}", "artist": "Artist", "time": "21:00", "type": "manual"} for i in range(size)}
+        db = {"venues": {"v1": {
+            "isPro": True,
+            "settings": {"city": "London", "timeout": 5},
+            "now_playing": {"track": "Wonderwall", "artist": "Oasis", "timestamp": 1},
+            "displays": {"d1": {"layout": "Landscape"}},
+            "history": history,
+        }}}
+        server, cloud_utils.FIREBASE_BASE = start_fake_firebase(db)
+
+        def old_way():
+            data = http_get(f"{cloud_utils.FIREBASE_BASE}/venues/v1.json", budget="firebase_read").json()
+            return data.get("isPro", False)
+
+        def new_way():
+            cloud_utils.invalidate_cloud_cache() # Measure a real round trip, not a cache hit
+            return cloud_utils.check_subscription_status("v1")
+
+        # What the venue hub does per poll: every display, strict isPro, settings, and now_playing
+        # (the stream isn't started here, so it's the polled one - the most a poll ever reads)
+        hub = VenueHub("v1")
+        def poll():
+            cloud_utils.invalidate_cloud_cache()
+            hub._poll_once(interval=0)
+            assert hub.errors == 0
+
+        print(f"{size:>8} | {timed(old_way, repeat):>21.2f} ms | {timed(new_way, repeat):>7.2f} ms | {timed(poll, repeat):>20.2f} ms")
+        server.shutdown()
+
+
+# --- LIVE STREAM: PUSH LATENCY + PROTOCOL CHECKS ---
+def bench_stream(pushes=20):
+    from cloud_utils import VenueStream
+
+    now_playing = {"track": "Wonderwall", "artist": "Oasis", "timestamp": 1}
+    db = {"venues": {"v1": {"now_playing": now_playing}}}
+    server, base_url = start_fake_firebase(db, keep_alive=0.2)
+    stream = VenueStream("v1", base_url=base_url, poll_interval=0.1, max_backoff=1)
+    pushed = threading.Event()
+    stream.subscribe(lambda *song: pushed.set())
+    stream.start()
+    try:
+        # The first put is the whole node
+        assert wait_for(lambda: stream.live and stream.has_data()), "stream never connected"
+        assert stream.now_playing() == ("Wonderwall", "Oasis", 1), stream.now_playing()
+
+        # A patch merges into what's there...
+        stream_event(server, "patch", {"path": "/", "data": {"track": "Supersonic", "timestamp": 2}})
+        assert wait_for(lambda: stream.now_playing() == ("Supersonic", "Oasis", 2)), stream.now_playing()
+        # ...and a null in a patch deletes the key
+        stream_event(server, "patch", {"path": "/", "data": {"artist": None}})
+        assert wait_for(lambda: "artist" not in stream._data), stream._data
+        stream_event(server, "put", {"path": "/artist", "data": "Oasis"})
+        assert wait_for(lambda: stream.now_playing() == ("Supersonic", "Oasis", 2)), stream.now_playing()
+
+        # Keep-alives (every 0.2s here) are not changes
+        version = stream.version
+        time.sleep(0.5)
+        assert stream.live and stream.version == version, "keep-alive counted as a change"
+
+        # Push latency: event sent -> subscriber called
+        latencies = []
+        for i in range(pushes):
+            pushed.clear()
+            start = time.perf_counter()
+            stream_event(server, "patch", {"path": "/", "data": {"timestamp": 100 + i}})
+            assert pushed.wait(5), "push never arrived"
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        # The socket drops: it reconnects, and the fresh put brings what changed meanwhile
+        requests = stream.requests
+        now_playing.update(track="Champagne Supernova", timestamp=3)
+        drop_streams(server)
+        assert wait_for(lambda: stream.requests > requests and stream.live), "never reconnected"
+        assert wait_for(lambda: stream.now_playing() == ("Champagne Supernova", "Oasis", 3)), stream.now_playing()
+
+        # Firebase cancels it and won't stream again for now: it polls the REST node instead...
+        server.refuse_streams = True
+        stream_event(server, "cancel", None)
+        assert wait_for(lambda: not stream.live), "cancel didn't drop the stream"
+        now_playing.update(track="Live Forever", timestamp=4)
+        assert wait_for(lambda: stream.now_playing() == ("Live Forever", "Oasis", 4)), "polling fallback missed a change"
+        assert not stream.live
+        # ...until the stream is back
+        server.refuse_streams = False
+        assert wait_for(lambda: stream.live), "never went back to the stream"
+        stream_event(server, "patch", {"path": "/", "data": {"track": "Slide Away"}})
+        assert wait_for(lambda: stream.now_playing()[0] == "Slide Away"), stream.now_playing()
+    finally:
+        stream.stop()
+        server.shutdown()
+
+    latencies.sort()
+    print("put, patch, null patch, keep-alive, drop + resume, cancel -> polling -> stream: all OK")
+    print(f"push latency over {pushes}: median {latencies[len(latencies) // 2]:.2f} ms, worst {latencies[-1]:.2f} ms ({stream.requests} requests)")
+
+
+# --- POSTER OUTPUT FORMATS ---
+def bench_assets():
+    """An asset record like fetch_spotify_assets returns, without Spotify."""
+    from io import BytesIO
+    from PIL import Image
+    cover_path = os.environ.get("BENCH_COVER")
+    if cover_path:
+        with open(cover_path, "rb") as f: cover_bytes = f.read()
+    else:
+        print("(synthetic cover - set BENCH_COVER=/path/to/cover.jpg for real art)")
+        buffer = BytesIO()
+        Image.effect_mandelbrot((640, 640), (-2.0, -1.25, 0.75, 1.25), 100).convert("RGB").save(buffer, format="JPEG")
+        cover_bytes = buffer.getvalue()
+    return {
+        "uri": "spotify:album:bench", "clean_name": "Definitely Maybe", "release_date": "AUG 29, 1994",
+        "display_tracks": [f"TRACK NUMBER {i}" for i in range(1, 12)], "duration_str": "51:57",
+        "cover_bytes": cover_bytes, "code_bytes": None,
+    }
+
+def bench_formats(repeat=3):
+    from poster_engine import compose_poster, encode_poster, POSTER_FORMATS
+    assets = bench_assets()
+    for orientation in ("Landscape", "Portrait"):
+        poster = compose_poster(assets, "Oasis", orientation)
+        print(f"\n{orientation} {poster.width}x{poster.height}")
+        print(f"{'format':>17} | {'encode':>9} | {'size':>8} | {'at 2 Mbps':>9}")
+        for fmt in POSTER_FORMATS:
+            size = len(encode_poster(poster, fmt).data)
+            print(f"{fmt:>17} | {timed(lambda: encode_poster(poster, fmt), repeat):>6.1f} ms | {size / 1024:>5.0f} KB | {size * 8 / 2e6:>7.2f} s")
+
+
+# --- SPOTIFY CODE OVERLAY ---
+def bench_code_bytes():
+    from io import BytesIO
+    from PIL import Image, ImageDraw
+    code_path = os.environ.get("BENCH_CODE")
+    if code_path:
+        with open(code_path, "rb") as f: return f.read()
+    code = Image.new("RGB", (640, 160), "black") # Same shape as scannables.scdn.co's white-on-black PNG
+    draw = ImageDraw.Draw(code)
+    for i in range(23):
+        bar = (7 * i * i + 3 * i) % 8 + 1
+        draw.rounded_rectangle([170 + i * 19, 80 - bar * 7, 180 + i * 19, 80 + bar * 7], radius=5, fill="white")
+    buffer = BytesIO()
+    code.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def bench_codemask(repeat=20):
+    from io import BytesIO
+    from PIL import Image
+    import poster_engine
+    code_bytes = bench_code_bytes()
+
+    def old_loop():
+        img = Image.open(BytesIO(code_bytes)).convert("RGBA")
+        img.putdata([(255, 255, 255, int(sum(item[:3]) / 3)) for item in img.getdata()])
+        for height in (90, 100): img.resize((int((height / img.height) * img.width), height))
+
+    def vectorized():
+        img = poster_engine.code_alpha_mask(Image.open(BytesIO(code_bytes)))
+        for height in (90, 100): img.resize((int((height / img.height) * img.width), height))
+
+    def cached():
+        for height in (90, 100): poster_engine.get_code_overlay("spotify:album:bench", code_bytes, height)
+
+    cached() # Warm it
+    print(f"{'per poster (both heights)':>26} | {'time':>9}")
+    print(f"{'old putdata loop':>26} | {timed(old_loop, repeat):>6.2f} ms")
+    print(f"{'NumPy mask':>26} | {timed(vectorized, repeat):>6.2f} ms")
+    print(f"{'cached overlay':>26} | {timed(cached, repeat):>6.3f} ms")
+
+
+def bench_textlayout(repeat=20):
+    from PIL import ImageFont
+    import text_layout
+    from font_registry import font_registry
+    if not font_registry.path: return print("No TrueType font here - nothing to measure")
+
+    # A deluxe-edition tracklist: 22 lines that all need truncating to a portrait column
+    tracks = [f"{i+1}. THE LONGEST SONG TITLE ON THE RECORD PART {i} (LIVE AT THE ROYAL ALBERT HALL, 1997 REMASTER)" for i in range(22)]
+    title = "THE COMPLETE AND UNABRIDGED ANTHOLOGY OF EVERY SESSION RECORDED BETWEEN 1991 AND 1999 " * 2
+    col_width, title_width = 430, 600
+
+    def old_layout(track_font, title_font):
+        for text in tracks:
+            if track_font.getlength(text) > col_width:
+                while track_font.getlength(text + "...") > col_width and len(text) > 0: text = text[:-1]
+        words = title.split()
+        line = words[0]
+        for word in words[1:]:
+            if title_font.getlength(line + " " + word) <= title_width: line += " " + word
+            else: line = word
+
+    def new_layout(track_font, title_font):
+        for text in tracks: text_layout.truncate(text, track_font, col_width)
+        text_layout.wrap(title, title_font, title_width)
+
+    def fresh_fonts(): # New font objects = empty measurer caches
+        return ImageFont.truetype(font_registry.path, 22), ImageFont.truetype(font_registry.path, 30)
+    warm = fresh_fonts()
+    new_layout(*warm)
+
+    print(f"{'22 tracks + long title':>26} | {'time':>9}")
+    print(f"{'old getlength loops':>26} | {timed(lambda: old_layout(*warm), repeat):>6.2f} ms")
+    print(f"{'text_layout, cold cache':>26} | {timed(lambda: new_layout(*fresh_fonts()), repeat):>6.2f} ms")
+    print(f"{'text_layout, warm cache':>26} | {timed(lambda: new_layout(*warm), repeat):>6.2f} ms")
+
+
+def bench_backdrop(repeat=5):
+    import numpy as np
+    import backdrop
+    cover_bytes = bench_assets()["cover_bytes"]
+    sizes = {"1080p landscape": ((1920, 1080), 12, 160), "1080p portrait": ((1080, 1920), 10, 130), "4K landscape": ((3840, 2160), 24, 160)}
+
+    print(f"{'':>16} | {'quality':>8} | {'render':>9} | {'cached':>8} | {'diff vs high':>12}")
+    for label, (size, radius, dim) in sizes.items():
+        reference = np.asarray(backdrop.render_background(cover_bytes, size, radius, dim, "high"), dtype=np.int16)
+        for quality in backdrop.BACKGROUND_QUALITIES:
+            render_ms = timed(lambda: backdrop.render_background(cover_bytes, size, radius, dim, quality), repeat)
+            cache = backdrop.BackgroundCache()
+            cache.get(cover_bytes, size, radius, dim, quality)
+            cached_ms = timed(lambda: cache.get(cover_bytes, size, radius, dim, quality), repeat)
+            diff = np.abs(np.asarray(backdrop.render_background(cover_bytes, size, radius, dim, quality), dtype=np.int16) - reference).mean()
+            print(f"{label:>16} | {quality:>8} | {render_ms:>6.1f} ms | {cached_ms:>5.1f} ms | {diff:>12.2f}")
+
+
+def bench_palette(repeat=10):
+    from io import BytesIO
+    from PIL import Image
+    import palette
+    cover_bytes = bench_assets()["cover_bytes"]
+
+    def old_bar():
+        cover_img = Image.open(BytesIO(cover_bytes)).convert("RGBA")
+        for i in range(4):
+            cover_img.crop((i * (cover_img.width // 4), 0, (i + 1) * (cover_img.width // 4), cover_img.height)).resize((1, 1), resample=Image.Resampling.LANCZOS).getpixel((0, 0))
+
+    print(f"{'':>30} | {'time':>9}")
+    print(f"{'old crops, every render':>30} | {timed(old_bar, repeat):>6.2f} ms")
+    print(f"{'quarters only, once per album':>30} | {timed(lambda: palette.extract_palette(cover_bytes, dominant=0), repeat):>6.2f} ms")
+    print(f"{'+ k-means, once per album':>30} | {timed(lambda: palette.extract_palette(cover_bytes), repeat):>6.2f} ms")
+    print(palette.extract_palette(cover_bytes))
+
+
+BENCHES = {
+    "subscription": bench_subscription,
+    "stream": bench_stream,
+    "formats": bench_formats,
+    "codemask": bench_codemask,
+    "textlayout": bench_textlayout,
+    "backdrop": bench_backdrop,
+    "palette": bench_palette,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHES:
+        print(f"\n=== {name} ===")
+        BENCHES[name]()
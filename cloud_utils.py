@@ -1,8 +1,13 @@
-import requests
 import time
+import json
+import random
+import threading
+import socket
+from dataclasses import dataclass, replace
 from datetime import datetime
 import os
 import streamlit as st
+from http_utils import http_get, http_put, http_delete
 
 def get_cred(key):
     if key in os.environ:
@@ -14,16 +19,130 @@ def get_cred(key):
 
 FIREBASE_BASE = get_cred("FIREBASE_BASE")
 
-def get_current_song_from_cloud(venue_id):
+# --- NODE PARSERS (shared by the node getters and the display snapshot) ---
+def _parse_now_playing(data):
+    if data and isinstance(data, dict) and 'track' in data and 'artist' in data:
+        # ⚡️ NEW: We now return the exact timestamp of the push!
+        return data['track'], data['artist'], data.get('timestamp', 0)
+    return None, None, 0
+
+def _parse_settings(data):
+    if data and isinstance(data, dict):
+        city = str(data.get("city") or "London")
+        try: timeout = int(data.get("timeout", 5))
+        except (TypeError, ValueError): timeout = 5
+        return city.strip(), timeout
+    return "London", 5 # Rock solid defaults just in case
+
+POLL_DEFAULTS = {"fast": 2, "steady": 5, "standby": 30, "fast_window": 60} # seconds
+POLL_LIMITS = (1, 300) # No venue gets to hammer Firebase, or go deaf for more than 5 minutes
+
+def _parse_polling(data):
+    """settings/polling -> {"fast", "steady", "standby", "fast_window"}, clamped and in order."""
+    polling = dict(POLL_DEFAULTS)
+    raw = data.get("polling") if isinstance(data, dict) else None
+    if isinstance(raw, dict):
+        for key in polling:
+            try: polling[key] = min(max(float(raw.get(key, polling[key])), POLL_LIMITS[0]), POLL_LIMITS[1])
+            except (TypeError, ValueError): pass
+    polling["steady"] = max(polling["steady"], polling["fast"])
+    polling["standby"] = max(polling["standby"], polling["steady"])
+    return polling
+
+def _parse_layout(val):
+    if val and isinstance(val, str):
+        return val.strip()
+    return "Landscape" # Default to Landscape if none is set
+
+def _parse_format(val):
+    if val and isinstance(val, str) and val.strip().lower() != "auto":
+        return val.strip().lower()
+    return None # No preference: the display picks from its link speed
+
+# --- ⚡️ READ-THROUGH CACHE FOR SLOW NODES ⚡️ ---
+# Subscription, settings and layout change maybe once a month, so we keep them in one
+# process-wide cache (shared by every Streamlit session) for a TTL, then revalidate
+# with Firebase's ETag: an unchanged node comes back as a tiny 304 instead of the body.
+NODE_TTLS = {
+    "subscription": 60,
+    "settings": 30,
+    "display": 5,   # Layout flips and unpairing should still land within a few seconds
+}
+
+class NodeCache:
+    def __init__(self):
+        self._entries = {} # url -> [value, etag, fetched_at]
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.revalidated = self.errors = 0
+
+    def get(self, url, ttl):
+        """Returns the node's JSON value. Raises if Firebase can't be reached."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry and time.time() - entry[2] < ttl:
+                self.hits += 1
+                return entry[0]
+
+        headers = {"X-Firebase-ETag": "true"}
+        if entry and entry[1]: headers["if-none-match"] = entry[1]
+        try:
+            res = http_get(url, budget="firebase_read", headers=headers)
+        except Exception:
+            with self._lock: self.errors += 1
+            raise
+
+        with self._lock:
+            if res.status_code == 304 and entry:
+                self.revalidated += 1
+                entry[2] = time.time()
+                return entry[0]
+            if res.status_code != 200:
+                self.errors += 1
+                res.raise_for_status()
+                raise ConnectionError(f"Unexpected HTTP {res.status_code} for {url}")
+            value = res.json()
+            self.misses += 1
+            self._entries[url] = [value, res.headers.get("ETag"), time.time()]
+            return value
+
+    def invalidate(self, *prefixes):
+        with self._lock:
+            for url in [u for u in self._entries if u.startswith(prefixes or ("",))]:
+                del self._entries[url]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "revalidated": self.revalidated,
+                    "errors": self.errors, "entries": len(self._entries)}
+
+_node_cache = NodeCache()
+
+def invalidate_cloud_cache(venue_id=None, display_id=None):
+    """Drops cached nodes so the next read goes to Firebase (everything, a venue, or one display)."""
+    if venue_id is None:
+        _node_cache.invalidate()
+        return
+    node = f"{FIREBASE_BASE}/venues/{venue_id}"
+    if display_id is None:
+        _node_cache.invalidate(node + ".json", node + "/")
+    else:
+        # The venue hub reads every display in one go, so it's that copy that has to go
+        _node_cache.invalidate(f"{node}/displays.json")
+
+def get_cloud_cache_stats():
+    return _node_cache.stats()
+
+def get_current_song_from_cloud(venue_id, strict=False):
+    """(track, artist, timestamp). strict=True raises if it can't be read, rather than
+    answering "nothing playing"."""
     url = f"{FIREBASE_BASE}/venues/{venue_id}/now_playing.json"
     try:
-        response = requests.get(url, timeout=5)
+        response = http_get(url, budget="firebase_read")
         if response.status_code == 200:
-            data = response.json()
-            if data and 'track' in data and 'artist' in data:
-                # ⚡️ NEW: We now return the exact timestamp of the push!
-                return data['track'], data['artist'], data.get('timestamp', 0)
-    except Exception: pass 
+            return _parse_now_playing(response.json())
+        if strict: raise ConnectionError(f"Unexpected HTTP {response.status_code} for {url}")
+    except Exception: 
+        if strict: raise
     return None, None, 0
 
 def log_manual_history(venue_id, album, artist):
@@ -36,76 +155,268 @@ def log_manual_history(venue_id, album, artist):
         "time": datetime.now().strftime("%H:%M"),
         "type": "manual"
     }
-    try: requests.put(url, json=payload, timeout=3)
+    try: http_put(url, budget="firebase_write", json=payload)
     except Exception: pass
 
 def init_pairing_code(code, display_id):
     url = f"{FIREBASE_BASE}/pairing_codes/{code}.json"
     payload = {"status": "waiting", "display_id": display_id, "timestamp": time.time()}
-    try: requests.put(url, json=payload, timeout=3)
+    try: http_put(url, budget="firebase_write", json=payload)
     except Exception: pass
 
 def check_pairing_status(code):
     url = f"{FIREBASE_BASE}/pairing_codes/{code}.json"
     try:
-        res = requests.get(url, timeout=5).json()
+        res = http_get(url, budget="firebase_read").json()
         if res and res.get("status") == "linked" and res.get("venue_id"):
-            requests.delete(url)
+            http_delete(url, budget="firebase_write")
             return res["venue_id"]
     except Exception: pass
     return None
 
-def check_if_unpaired(venue_id, display_id):
-    url = f"{FIREBASE_BASE}/venues/{venue_id}/displays/{display_id}.json"
-    try:
-        res = requests.get(url)
-        if res.status_code == 200 and res.json() is None:
-            return True # Missing from database = unpaired
-    except Exception: pass
-    return False
-
 def unpair_from_cloud(venue_id, display_id):
     url = f"{FIREBASE_BASE}/venues/{venue_id}/displays/{display_id}.json"
-    try: requests.delete(url)
+    try: http_delete(url, budget="firebase_write")
     except Exception: pass
+    invalidate_cloud_cache(venue_id, display_id)
 
-def check_subscription_status(venue_id):
-    """Checks if the venue has an active Pro subscription."""
-    url = f"{FIREBASE_BASE}/venues/{venue_id}.json"
+def check_subscription_status(venue_id, strict=False):
+    """Checks if the venue has an active Pro subscription. strict=True raises if it can't be read
+    (instead of answering False), so callers can keep the last answer they trust."""
+    # ⚡️ Read ONLY the isPro leaf. Reading venues/{id}.json pulled down every display
+    # and the whole ever-growing history node just to look at one boolean.
+    url = f"{FIREBASE_BASE}/venues/{venue_id}/isPro.json"
     try:
-        response = requests.get(url, timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            if data and isinstance(data, dict):
-                return data.get('isPro', False)
+        return bool(_node_cache.get(url, NODE_TTLS["subscription"]))
     except Exception: 
-        pass 
+        if strict: raise
     return False
 
-def get_display_layout(venue_id, display_id):
-    """Fetches the specific layout preference for a single display via REST API."""
-    url = f"{FIREBASE_BASE}/venues/{venue_id}/displays/{display_id}/layout.json"
+def get_venue_settings(venue_id, strict=False):
+    """Fetches the global venue settings for weather and standby timeout. strict=True raises
+    if they can't be read, instead of answering with the defaults."""
+    url = f"{FIREBASE_BASE}/venues/{venue_id}/settings.json"
     try:
-        response = requests.get(url, timeout=5)
-        if response.status_code == 200:
-            val = response.json()
-            if val and isinstance(val, str):
-                return val.strip()
+        return _parse_settings(_node_cache.get(url, NODE_TTLS["settings"]))
     except Exception as e:
-        print(f"Error fetching display layout: {e}")
-    return "Landscape" # Default to Landscape if none is set or an error occurs
+        if strict: raise
+    return _parse_settings(None)
 
-def get_venue_settings(venue_id):
-    """Fetches the global venue settings for weather and standby timeout."""
+def get_venue_polling(venue_id, strict=False):
+    """The venue's polling bounds (same cached settings node as get_venue_settings, so no extra read)."""
     url = f"{FIREBASE_BASE}/venues/{venue_id}/settings.json"
     try:
-        response = requests.get(url, timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            if data and isinstance(data, dict):
-                city = data.get("city", "London")
-                timeout = int(data.get("timeout", 5))
-                return city.strip(), timeout
-    except Exception as e:
-        pass
-    return "London", 5 # Rock solid defaults just in case
+        return _parse_polling(_node_cache.get(url, NODE_TTLS["settings"]))
+    except Exception:
+        if strict: raise
+    return _parse_polling(None)
+
+# --- ⚡️ ONE SNAPSHOT PER TICK ⚡️ ---
+# The listener used to make five round trips a second (pairing, subscription, settings,
+# layout, now playing). Now the venue hub (venue_hub.py) reads them once per poll for
+# every display - the slow nodes out of the shared node cache, now_playing only while the
+# venue stream isn't pushing it - and each display's snapshot is built from that copy.
+@dataclass(frozen=True)
+class DisplaySnapshot:
+    ok: bool = False        # False = the cloud didn't answer, the rest are just defaults
+    paired: bool = True
+    is_pro: bool = False
+    city: str = "London"
+    timeout: int = 5
+    layout: str = "Landscape"
+    track: str = None
+    artist: str = None
+    timestamp: float = 0
+    format: str = None      # Poster encoding the display asked for in its layout record, if any
+
+def make_display_snapshot(display, is_pro, settings, now_playing):
+    """display = the display's node (None = unpaired), settings = (city, timeout), now_playing = (track, artist, timestamp)."""
+    layout = _parse_layout(display.get("layout") if isinstance(display, dict) else None)
+    fmt = _parse_format(display.get("format") if isinstance(display, dict) else None)
+    city, timeout = settings
+    track, artist, timestamp = now_playing
+    return DisplaySnapshot(
+        ok=True,
+        paired=display is not None, # Missing from database = unpaired
+        is_pro=bool(is_pro),
+        city=city, timeout=timeout, layout=layout,
+        track=track, artist=artist, timestamp=timestamp, format=fmt,
+    )
+
+def read_venue_displays(venue_id, ttl=None):
+    """Every display node in the venue in ONE (cached) read: {display_id: node}. Raises if Firebase can't be reached."""
+    displays = _node_cache.get(f"{FIREBASE_BASE}/venues/{venue_id}/displays.json", NODE_TTLS["display"] if ttl is None else ttl)
+    return displays if isinstance(displays, dict) else {}
+
+
+# --- ⚡️ LIVE PUSH: FIREBASE REST EVENT STREAM ⚡️ ---
+# Instead of asking "anything new?" every second, we hold one text/event-stream
+# connection per venue on now_playing and Firebase pushes put/patch events at us.
+# If the stream drops we reconnect with backoff (Firebase re-sends the full node on
+# connect, which is our resume), and poll the REST node in the meantime.
+def _response_socket(response):
+    """The socket under a streamed requests response, or None."""
+    raw = getattr(response, "raw", None)
+    for path in (("_connection", "sock"), ("_fp", "fp", "raw", "_sock")): # urllib3 2.x, then http.client's
+        node = raw
+        for attr in path: node = getattr(node, attr, None)
+        if isinstance(node, socket.socket): return node
+    return None
+
+
+def _merge_patch(node, changes):
+    """A Firebase patch: each key is overwritten, and a null deletes it."""
+    for key, value in changes.items():
+        if value is None: node.pop(key, None)
+        else: node[key] = value
+    return node
+
+
+class VenueStream:
+    """One live now_playing feed for a venue, shared by every display that subscribes."""
+
+    def __init__(self, venue_id, base_url=None, poll_interval=1.0, max_backoff=30):
+        self.venue_id = venue_id
+        self.base_url = base_url or FIREBASE_BASE
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.live = False           # True while the event-stream is connected
+        self.version = 0            # Bumped every time now_playing actually changes
+        self.requests = 0           # Stream connects + fallback polls
+        self._data = None
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._response = None
+
+    @property
+    def url(self):
+        return f"{self.base_url}/venues/{self.venue_id}/now_playing.json"
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"venue-stream-{self.venue_id}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Never blocks. response.close() from here would wait for the reader thread's
+        iter_lines to come back (i.e. the next keep-alive, up to 30s), so instead the socket
+        is shut down under it - the read fails at once and the reader cleans up."""
+        self._stop.set()
+        response = self._response
+        if response is None: return
+        sock = _response_socket(response)
+        if sock is not None:
+            try: sock.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+        else: # Couldn't reach the socket: close it off to the side rather than wait here
+            threading.Thread(target=response.close, daemon=True).start()
+
+    def subscribe(self, callback):
+        """Calls callback(track, artist, timestamp) on every change. Returns an unsubscribe function."""
+        with self._lock: self._subscribers.append(callback)
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers: self._subscribers.remove(callback)
+        return unsubscribe
+
+    def now_playing(self):
+        with self._lock: return _parse_now_playing(self._data)
+
+    def has_data(self):
+        with self._lock: return self._data is not None
+
+    def apply_to(self, snapshot):
+        """Overlays the pushed now_playing on a (slower) DisplaySnapshot."""
+        if not self.has_data(): return snapshot
+        track, artist, timestamp = self.now_playing()
+        return replace(snapshot, track=track, artist=artist, timestamp=timestamp)
+
+    # --- internals ---
+    def _set(self, data):
+        with self._lock:
+            if data == self._data: return # Reconnect re-sends the same node - not a new push
+            self._data = data
+            self.version += 1
+            subscribers = list(self._subscribers)
+        track, artist, timestamp = _parse_now_playing(data)
+        for callback in subscribers:
+            try: callback(track, artist, timestamp)
+            except Exception as e: print(f"Stream subscriber failed: {e}")
+
+    def _apply_event(self, event, payload):
+        if event in ("keep-alive", None): return
+        if event == "cancel": raise PermissionError("Firebase cancelled the stream")
+        if event == "auth_revoked": raise ConnectionError("Firebase auth revoked")
+        if event not in ("put", "patch") or not isinstance(payload, dict): return
+
+        path = [p for p in payload.get("path", "/").split("/") if p]
+        with self._lock:
+            data = json.loads(json.dumps(self._data)) if self._data is not None else None
+        if not path:
+            if event == "put": data = payload.get("data")
+            elif isinstance(payload.get("data"), dict):
+                data = _merge_patch(data if isinstance(data, dict) else {}, payload["data"]) or None
+        else:
+            data = data if isinstance(data, dict) else {}
+            node = data
+            for key in path[:-1]: node = node.setdefault(key, {})
+            if event == "put":
+                if payload.get("data") is None: node.pop(path[-1], None)
+                else: node[path[-1]] = payload.get("data")
+            elif isinstance(payload.get("data"), dict):
+                child = node.get(path[-1])
+                node[path[-1]] = _merge_patch(child if isinstance(child, dict) else {}, payload["data"])
+                if not node[path[-1]]: del node[path[-1]]
+        self._set(data)
+
+    def _stream_once(self):
+        headers = {"Accept": "text/event-stream"}
+        # The stream budget's 60s read timeout = two missed keep-alives = a dead socket.
+        self.requests += 1
+        self._response = http_get(self.url, budget="firebase_stream", headers=headers, stream=True)
+        with self._response as res:
+            if res.status_code != 200:
+                raise ConnectionError(f"Stream refused with HTTP {res.status_code}")
+            self.live = True
+            event, data_lines = None, []
+            # chunk_size=1: the default 512-byte buffer would sit on small events
+            for line in res.iter_lines(chunk_size=1, decode_unicode=True):
+                if self._stop.is_set(): return
+                if line is None: continue
+                if line == "":
+                    if event or data_lines:
+                        raw = "\n".join(data_lines)
+                        self._apply_event(event, json.loads(raw) if raw else None)
+                    event, data_lines = None, []
+                elif line.startswith("event:"): event = line[6:].strip()
+                elif line.startswith("data:"): data_lines.append(line[5:].strip())
+
+    def _poll_once(self):
+        self.requests += 1
+        try:
+            res = http_get(self.url, budget="firebase_read")
+            if res.status_code == 200: self._set(res.json())
+        except Exception: pass
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self._stream_once()
+            except Exception as e:
+                if not self._stop.is_set(): print(f"Venue stream {self.venue_id} dropped: {e}")
+            finally:
+                self.live = False
+            if self._stop.is_set(): return
+
+            if time.time() - started > 60: backoff = 1 # It was healthy for a while, retry quickly
+            # Polling fallback until it's time to try the stream again
+            retry_at = time.time() + backoff * random.uniform(0.5, 1.5)
+            while time.time() < retry_at and not self._stop.is_set():
+                self._poll_once()
+                self._stop.wait(self.poll_interval)
+            backoff = min(backoff * 2, self.max_backoff)
@@ -0,0 +1,86 @@
+import os
+import threading
+
+from PIL import ImageFont
+
+# --- ⚡️ FONT REGISTRY ⚡️ ---
+# get_safe_font used to walk five font paths (three of them macOS-only) with a try/except
+# and load a fresh TrueType face for every size on every render - about eight loads per
+# poster. Now the font file is found once per process and each size is loaded once and
+# reused. Point POSTER_FONT_DIR at the fonts directory on a deployment (e.g.
+# /usr/share/fonts/truetype/dejavu) and only that directory is looked at.
+#
+# Sharing faces between the render threads is fine: Pillow holds the GIL while FreeType
+# measures or draws.
+
+POSTER_FONT_DIR = os.environ.get("POSTER_FONT_DIR")
+POSTER_FONT_FILES = ( # In order of preference
+    "Arial Narrow Bold.ttf",
+    "Arial Bold.ttf",
+    "DejaVuSans-Bold.ttf",
+    "LiberationSans-Bold.ttf",
+)
+FONT_SEARCH_PATHS = ( # Used when no font dir is set (or nothing usable is in it)
+    "/System/Library/Fonts/Supplemental/Arial Narrow Bold.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+    "/Library/Fonts/Arial Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+)
+
+
+class FontRegistry:
+    def __init__(self, font_dir=POSTER_FONT_DIR):
+        self.font_dir = font_dir
+        self.path = None          # The font file every size comes from (None = Pillow's built-in font)
+        self.loads = self.hits = 0
+        self._resolved = False
+        self._fonts = {}          # size -> FreeTypeFont
+        self._lock = threading.Lock()
+
+    def _candidates(self):
+        if self.font_dir:
+            yield from (os.path.join(self.font_dir, name) for name in POSTER_FONT_FILES)
+        yield from FONT_SEARCH_PATHS
+
+    def resolve(self):
+        """Finds the font file (once). Returns its path, or None if only the default font is left."""
+        with self._lock:
+            if not self._resolved:
+                for path in self._candidates():
+                    # Check first: given a missing path, Pillow goes hunting through the
+                    # system font directories for that file name, which is the slow part
+                    if not os.path.isfile(path): continue
+                    try:
+                        ImageFont.truetype(path, 10)
+                    except OSError:
+                        continue
+                    self.path = path
+                    break
+                else:
+                    print("No poster font found - falling back to Pillow's default font")
+                if self.font_dir and self.path and not self.path.startswith(self.font_dir):
+                    print(f"Nothing usable in POSTER_FONT_DIR={self.font_dir}, using {self.path}")
+                self._resolved = True
+            return self.path
+
+    def get(self, size):
+        with self._lock:
+            font = self._fonts.get(size)
+            if font is not None:
+                self.hits += 1
+                return font
+        path = self.resolve()
+        font = ImageFont.truetype(path, size) if path else ImageFont.load_default()
+        with self._lock:
+            font = self._fonts.setdefault(size, font) # Another thread may have beaten us to it
+            self.loads += 1
+        return font
+
+    def stats(self):
+        with self._lock:
+            return {"path": self.path, "sizes_loaded": len(self._fonts), "loads": self.loads, "hits": self.hits}
+
+
+font_registry = FontRegistry()
+font_registry.resolve() # At startup, not in the middle of the first render
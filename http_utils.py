@@ -0,0 +1,149 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- ONE TRANSPORT FOR THE WHOLE PROCESS ---
+# Every Firebase, Spotify and weather call goes through here, so each host gets one
+# keep-alive connection pool (no fresh TCP+TLS handshake per call), a timeout on
+# EVERY request, retries with jittered backoff, and a circuit breaker so a dead
+# upstream fails in microseconds instead of stalling every display's fragment.
+
+# (connect, read) seconds per kind of call
+TIMEOUTS = {
+    "default": (3, 5),
+    "firebase_read": (3, 5),
+    "firebase_write": (3, 3),
+    "firebase_stream": (5, 60),  # Firebase sends a keep-alive every ~30s
+    "spotify_api": (3, 8),
+    "spotify_image": (3, 10),
+    "weather": (3, 3),
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRY_AFTER = 1.0 # seconds; a longer Retry-After is the breaker's (and the negative cache's) problem
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of making a request while a host's breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures, lets one trial call through after `cooldown` seconds."""
+
+    def __init__(self, threshold=5, cooldown=15):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None: return "closed"
+            return "half-open" if time.time() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None: return True
+            if time.time() - self.opened_at >= self.cooldown:
+                self.opened_at = time.time() # One trial per cooldown window
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures, self.opened_at = 0, None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+
+class CappedRetry(Retry):
+    """Retry that honours Retry-After only up to MAX_RETRY_AFTER. A Spotify 429 can ask for
+    minutes, and urllib3 would sleep all of it inside a render worker before we even saw it."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, MAX_RETRY_AFTER)
+
+
+class PooledSession(requests.Session):
+    """A keep-alive Session for one host that always has a timeout and respects the host's breaker."""
+
+    def __init__(self, host, breaker):
+        super().__init__()
+        self.host = host
+        self.breaker = breaker
+        retry = CappedRetry(
+            total=2, connect=2, read=1, status=2,
+            backoff_factor=0.2, backoff_jitter=0.3,
+            status_forcelist=RETRY_STATUSES, allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=True, raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout") is None: kwargs["timeout"] = TIMEOUTS["default"]
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {self.host}, skipping {method} {url}")
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code in RETRY_STATUSES: self.breaker.record_failure()
+        else: self.breaker.record_success()
+        return response
+
+    def close(self):
+        # Shared for the life of the process. Borrowers like spotipy close() their session
+        # in __del__, which would throw away every pooled connection for everyone else.
+        pass
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(url):
+    """The shared session for the host of `url` (also accepts a bare host)."""
+    host = urlparse(url).netloc or url
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = PooledSession(host, CircuitBreaker())
+        return session
+
+_thread_requests = threading.local() # Per-thread request counter, so a poller can count its own traffic
+
+def thread_request_count():
+    """HTTP requests made so far by the current thread."""
+    return getattr(_thread_requests, "count", 0)
+
+def http_request(method, url, budget="default", **kwargs):
+    kwargs.setdefault("timeout", TIMEOUTS.get(budget, TIMEOUTS["default"]))
+    _thread_requests.count = thread_request_count() + 1
+    return get_session(url).request(method, url, **kwargs)
+
+def http_get(url, budget="default", **kwargs):
+    return http_request("GET", url, budget, **kwargs)
+
+def http_put(url, budget="default", **kwargs):
+    return http_request("PUT", url, budget, **kwargs)
+
+def http_delete(url, budget="default", **kwargs):
+    return http_request("DELETE", url, budget, **kwargs)
+
+def get_breaker_states():
+    with _sessions_lock:
+        return {host: session.breaker.state for host, session in _sessions.items()}
@@ -0,0 +1,147 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import unicodedata
+
+try:
+    import fcntl # Linux/macOS: lets several worker processes agree on who runs eviction
+except ImportError:
+    fcntl = None
+
+# --- ⚡️ PERSISTENT ON-DISK CACHE ⚡️ ---
+# st.cache_data lives in RAM, so every deploy or restart on Render threw away every
+# poster we'd ever made. Finished posters now also land on disk as encoded bytes, keyed
+# by a content hash, so a hit after a restart is one file read instead of Spotify + Pillow.
+#
+# Safe for several processes sharing the directory: files are written to a temp file
+# and os.replace()d into place (readers never see half a file), LRU order comes from
+# mtimes (bumped on every hit), and only one process at a time runs eviction.
+
+POSTER_CACHE_DIR = os.environ.get("POSTER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".poster_cache"))
+POSTER_CACHE_MAX_BYTES = int(os.environ.get("POSTER_CACHE_MAX_MB", 512)) * 1024 * 1024
+
+
+def normalize_key_part(value):
+    """'  Definitely  MAYBE ' and 'definitely maybe' should be the same poster."""
+    return " ".join(unicodedata.normalize("NFKC", str(value)).casefold().split())
+
+def make_key(*parts):
+    return hashlib.sha256("\x1f".join(normalize_key_part(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """A size-bounded, content-addressed directory of blobs with LRU eviction."""
+
+    def __init__(self, directory, max_bytes, suffix=".bin"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = self.misses = self.writes = self.evictions = 0
+        self._approx_bytes = None # Lazily measured, then tracked on writes
+        self._lock = threading.Lock()
+
+    def path_for(self, key):
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as f: data = f.read()
+        except OSError:
+            with self._lock: self.misses += 1
+            return None
+        try: os.utime(path) # Bump for LRU
+        except OSError: pass
+        with self._lock: self.hits += 1
+        return data
+
+    def get_mapped(self, key):
+        """Like get(), but reads the file through a memory map (straight out of the page
+        cache). The map and its file are closed before returning: one left open until GC
+        would pin the file's space even after eviction unlinks it."""
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                data = mapped[:]
+        except (OSError, ValueError): # ValueError = empty file, nothing to map
+            with self._lock: self.misses += 1
+            return None
+        try: os.utime(path)
+        except OSError: pass
+        with self._lock: self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self.path_for(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f: f.write(data)
+                try: replaced = os.stat(path).st_size # Overwriting: those bytes are freed
+                except OSError: replaced = 0
+                os.replace(tmp_path, path)
+            except BaseException:
+                try: os.unlink(tmp_path)
+                except OSError: pass
+                raise
+        except OSError as e:
+            print(f"Disk cache write failed ({path}): {e}")
+            return False
+
+        with self._lock:
+            self.writes += 1
+            if self._approx_bytes is not None: self._approx_bytes += len(data) - replaced
+        if self._approx_bytes is None or self._approx_bytes > self.max_bytes:
+            self.evict()
+        return True
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(self.suffix): continue
+                path = os.path.join(root, name)
+                try: info = os.stat(path)
+                except OSError: continue # Another process just evicted it
+                entries.append((info.st_mtime, info.st_size, path))
+        return entries
+
+    def evict(self):
+        """Deletes least-recently-used files until the directory is back under budget."""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, ".evict.lock"), "a")
+        try:
+            if fcntl is not None:
+                try: fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError: return # Someone else is already evicting
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes: break
+                try:
+                    os.unlink(path)
+                    total -= size
+                    with self._lock: self.evictions += 1
+                except FileNotFoundError:
+                    total -= size
+                except OSError: pass
+            with self._lock: self._approx_bytes = total
+        finally:
+            lock_file.close()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "writes": self.writes,
+                    "evictions": self.evictions, "bytes": self._approx_bytes}
+
+
+# Both live in the same directory but only evict their own suffix, so they split the budget.
+# The encoded posters are what screens are actually sent; the masters only spare a re-render
+# when a second format of a poster is asked for.
+POSTER_MASTER_SHARE = 0.25
+poster_cache = DiskCache(POSTER_CACHE_DIR, int(POSTER_CACHE_MAX_BYTES * POSTER_MASTER_SHARE), suffix=".png")
+encoded_cache = DiskCache(POSTER_CACHE_DIR, POSTER_CACHE_MAX_BYTES - poster_cache.max_bytes, suffix=".img")
@@ -1,25 +1,27 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import requests
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from collections import OrderedDict
+from dataclasses import dataclass
+from PIL import Image, ImageDraw, features
 from datetime import datetime
 import re
-import os
-import streamlit as st
-
-# --- SECURE CREDENTIAL FETCHER ---
-def get_cred(key):
-    if key in os.environ:
-        return os.environ[key]
-    try:
-        return st.secrets[key]
-    except Exception:
-        return None
-
-# --- CREDENTIALS ---
-SPOTIPY_CLIENT_ID = get_cred("SPOTIPY_CLIENT_ID")
-SPOTIPY_CLIENT_SECRET = get_cred("SPOTIPY_CLIENT_SECRET")
+import hashlib
+import inspect
+import queue
+import threading
+import time
+import numpy as np
+from http_utils import http_get
+from spotify_client import get_spotify, thread_call_count
+from poster_cache import poster_cache, encoded_cache, make_key
+from asset_store import asset_store
+from font_registry import font_registry
+from text_layout import measurer_for, truncate, wrap, fit_tracks
+from backdrop import background_cache, BACKGROUND_QUALITY
+from palette import extract_palette, is_current as palette_is_current
+from resolver_index import resolver_index, normalize_track, normalize_artist
+from singleflight import resolve_flight, fetch_flight, render_flight
+from render_service import render_service, publish_preview, PRIORITY_WARMUP
+import text_layout, backdrop, palette
 
 # --- TEXT HELPERS ---
 def clean_album_title(title):
@@ -34,53 +36,100 @@ def clean_album_title(title):
 def clean_track_title(title):
     return re.sub(r'[\(\[].*?[\)\]]', '', title).split('-')[0].strip()
 
-def draw_wrapped_text(draw, text, font, max_width, x_anchor, start_y, fill, align="right"):
+def draw_wrapped_text(draw, text, font, max_width, x_anchor, start_y, fill, align="right", line_gap=10):
     if not text or not text.strip(): return start_y
-    lines, words = [], text.split()
-    if not words: return start_y
-    current_line = words[0]
-    for word in words[1:]:
-        if font.getlength(current_line + " " + word) <= max_width: current_line += " " + word
-        else: lines.append(current_line); current_line = word
-    lines.append(current_line)
-    
-    current_y, line_height = start_y, font.getbbox("A")[3] + 10 
-    for line in lines:
+    measure = measurer_for(font) # Cached glyph widths (see text_layout.py)
+    current_y, line_height = start_y, measure.cap_height + line_gap
+    for line in wrap(text, font, max_width):
         if align == "right":
-            draw.text((x_anchor - font.getlength(line), current_y), line, font=font, fill=fill)
+            draw.text((x_anchor - measure.width(line), current_y), line, font=font, fill=fill)
         else:
             draw.text((x_anchor, current_y), line, font=font, fill=fill)
         current_y += line_height
     return current_y
 
 def truncate_text(text, font, max_width):
-    if font.getlength(text) <= max_width: return text
-    while font.getlength(text + "...") > max_width and len(text) > 0: text = text[:-1]
-    return text.strip() + "..."
+    return truncate(text, font, max_width)
+
+def get_safe_font(size):
+    return font_registry.get(size) # Found once, loaded once per size (see font_registry.py)
 
 # --- SPOTIFY HELPERS ---
-@st.cache_data(ttl=86400, show_spinner=False)
-def get_album_from_track(track_name, artist_name):
-    sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=SPOTIPY_CLIENT_ID, client_secret=SPOTIPY_CLIENT_SECRET))
+# ⚡️ Track -> album in ONE search (plus a looser fallback search only if that misses).
+# We keep the album ID from the hit, so the assets come from one sp.album(id) call
+# instead of re-searching by album name (which could even land on a different album).
+# The resolver index (SQLite, normalised + fuzzy keys) answers first, so "Wonderwall",
+# "Wonderwall - Remastered" and "WONDERWALL (feat. X)" only ever cost one Spotify search.
+def resolve_track(track_name, artist_name, venue_id=None):
+    """Returns {"id", "name"} for the album the track is on, or None."""
+    known = resolver_index.lookup(track_name, artist_name, venue_id)
+    # Eight TVs asking about the same new song at once = one search
+    flight_key = (normalize_track(track_name), normalize_artist(artist_name))
+    if known:
+        if known.get("fuzzy"): _verify_close_match(flight_key, track_name, artist_name)
+        return known
+    return resolve_flight.do(flight_key, _search_track, track_name, artist_name)
+
+def _verify_close_match(flight_key, track_name, artist_name):
+    """Show the close match now, but let Spotify have the last word for next time: a real
+    search, queued behind every render (one per key) and backed off like any other lookup."""
+    verify_key = ("verify",) + flight_key # Its own failures: a failed double-check mustn't block the poster
+    if time.time() < negative_cache.retry_at(verify_key): return
+    render_service.submit(verify_key, _search_close_match, verify_key, track_name, artist_name, priority=PRIORITY_WARMUP)
+
+def _search_close_match(verify_key, track_name, artist_name):
+    try: album = resolve_flight.do(verify_key[1:], _search_track, track_name, artist_name) # Stores the real answer under its own key
+    except Exception as e:
+        print(f"Couldn't double-check '{track_name}' by {artist_name}: {e}")
+        album = None
+    if album: negative_cache.record_success(verify_key)
+    else: negative_cache.record_failure(verify_key)
+    return album
+
+def _search_track(track_name, artist_name):
+    sp = get_spotify()
     results = sp.search(q=f"track:{track_name} artist:{artist_name}", type='track', limit=1)
-    if results['tracks']['items']: return results['tracks']['items'][0]['album']['name']
-    fallback = sp.search(q=f"{track_name} {artist_name}", type='track', limit=1)
-    if fallback['tracks']['items']: return fallback['tracks']['items'][0]['album']['name']
-    return None
+    if not results['tracks']['items']:
+        results = sp.search(q=f"{track_name} {artist_name}", type='track', limit=1)
+    if not results['tracks']['items']: return None
+    album = results['tracks']['items'][0]['album']
+    album = {"id": album['id'], "name": album['name']}
+    resolver_index.remember(track_name, artist_name, album)
+    return album
+
+def get_album_from_track(track_name, artist_name):
+    album = resolve_track(track_name, artist_name)
+    return album['name'] if album else None
 
 # ⚡️ STAGE 1 CACHE: Fetching the raw assets from Spotify ONLY ONCE ⚡️
-@st.cache_data(ttl=86400, show_spinner=False)
-def fetch_spotify_assets(album_name, artist_name):
-    sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=SPOTIPY_CLIENT_ID, client_secret=SPOTIPY_CLIENT_SECRET))
-    results = sp.search(q=f"album:{album_name} artist:{artist_name}", type='album', limit=1)
-    if not results['albums']['items']: 
-        results = sp.search(q=f"{album_name}", type='album', limit=1)
-    if not results['albums']['items']: return None
+# The asset store on disk is the cache now (it survives restarts), so no st.cache_data here:
+# the OS page cache keeps hot covers in RAM anyway.
+def fetch_spotify_assets(album_name, artist_name, album_id=None):
+    uri = f"spotify:album:{album_id}" if album_id else asset_store.lookup_alias(album_name, artist_name)
+    if uri:
+        stored = asset_store.get(uri)
+        if stored:
+            if not palette_is_current(stored.get("palette")): # Stored before palettes (or an older version of them)
+                stored["palette"] = extract_palette(stored["cover_bytes"])
+                asset_store.put_meta(uri, stored)
+            return stored
+    flight_key = album_id or make_key(album_name, artist_name)
+    return fetch_flight.do(flight_key, _download_assets, album_name, artist_name, album_id)
+
+def _download_assets(album_name, artist_name, album_id=None):
+    sp = get_spotify()
+    if not album_id:
+        # Only callers that don't know the album ID still pay for a search by name
+        results = sp.search(q=f"album:{album_name} artist:{artist_name}", type='album', limit=1)
+        if not results['albums']['items']: 
+            results = sp.search(q=f"{album_name}", type='album', limit=1)
+        if not results['albums']['items']: return None
+        album_id = results['albums']['items'][0]['id']
     
-    album = results['albums']['items'][0]
-    album_details = sp.album(album['id'])
-    clean_name = clean_album_title(album['name'])
-    cover_url, uri = album['images'][0]['url'], album['uri'] 
+    # Name, cover, URI, release date AND the tracklist all come back from this one call
+    album_details = sp.album(album_id)
+    clean_name = clean_album_title(album_details['name'])
+    cover_url, uri = album_details['images'][0]['url'], album_details['uri'] 
 
     try: release_date = datetime.strptime(album_details['release_date'], '%Y-%m-%d').strftime('%b %d, %Y').upper()
     except ValueError: release_date = album_details['release_date']
@@ -95,95 +144,205 @@ def fetch_spotify_assets(album_name, artist_name):
     duration_str = f"{total_ms // 60000}:{(total_ms % 60000) // 1000:02d}"
 
     headers = {'User-Agent': 'Mozilla/5.0'}
-    cover_bytes = requests.get(cover_url, headers=headers).content
+    cover_response = http_get(cover_url, budget="spotify_image", headers=headers)
+    cover_response.raise_for_status() # Never persist an error page as album art
+    cover_bytes = cover_response.content
+    _cover_arrived(cover_bytes) # Preview now, before we go and get the Spotify code
     
-    code_response = requests.get(f"https://scannables.scdn.co/uri/plain/png/000000/white/640/{uri}")
+    code_response = http_get(f"https://scannables.scdn.co/uri/plain/png/000000/white/640/{uri}", budget="spotify_image")
     code_bytes = code_response.content if code_response.status_code == 200 else None
 
-    # Return pure data and raw image bytes so Streamlit can cache it perfectly
-    return {
+    # Return pure data and raw image bytes, and keep a copy on disk for next time
+    assets = {
+        "uri": uri,
         "clean_name": clean_name,
         "release_date": release_date,
         "display_tracks": display_tracks,
         "duration_str": duration_str,
+        "palette": extract_palette(cover_bytes), # Colour bar etc., worked out once per album (see palette.py)
         "cover_bytes": cover_bytes,
         "code_bytes": code_bytes
     }
+    asset_store.put(uri, assets)
+    asset_store.add_alias(album_name, artist_name, uri)
+    return assets
+
+# ⚡️ RESOLUTION TIERS ⚡️
+# 4K panels used to get an upscaled, soft 1080p poster and 720p sticks paid to render and
+# download pixels they threw away. Posters now come in tiers (named by the short side) and
+# each display gets the smallest tier that covers the screen size its browser reports.
+RESOLUTION_TIERS = (720, 1080, 1440, 2160)
+DEFAULT_RESOLUTION = 1080
+
+
+def choose_resolution(screen_w=None, screen_h=None, orientation="Landscape"):
+    """Physical screen size in pixels -> resolution tier for this layout."""
+    if not screen_w or not screen_h: return DEFAULT_RESOLUTION
+    # The short side of the poster as it will be shown ('contain') on this screen
+    if orientation == "Portrait": needed = min(screen_w, screen_h * 9 / 16)
+    else: needed = min(screen_h, screen_w * 9 / 16)
+    for tier in RESOLUTION_TIERS:
+        if tier >= needed * 0.95: return tier # A few pixels short (browser chrome, rounding) still counts
+    return RESOLUTION_TIERS[-1]
+
 
 # ⚡️ STAGE 2 CACHE: Generating the actual layout per orientation ⚡️
-@st.cache_data(ttl=86400, show_spinner=False)
-def create_poster(album_name, artist_name, orientation="Portrait"):
-    assets = fetch_spotify_assets(album_name, artist_name)
+# disk (poster_cache, survives restarts) -> actually render it. No RAM cache: only the
+# encode step reads this (once per format, see get_encoded_poster), and a 4K poster held
+# as raw pixels is ~25MB per album, layout and tier.
+def create_poster(album_name, artist_name, orientation="Portrait", album_id=None, resolution=DEFAULT_RESOLUTION):
+    key = _poster_key(album_name, artist_name, orientation, resolution)
+    cached = poster_cache.get(key)
+    if cached:
+        poster = Image.open(BytesIO(cached))
+        poster.load()
+        return poster
+
+    return render_flight.do(key, _render_and_store, key, album_name, artist_name, orientation, album_id, resolution)
+
+def _poster_size(orientation, resolution=DEFAULT_RESOLUTION):
+    long_side = round(resolution * 16 / 9)
+    # Sideways TV is rotated back to landscape
+    return (resolution, long_side) if orientation == "Portrait" else (long_side, resolution)
+
+def _poster_key(album_name, artist_name, orientation, resolution=DEFAULT_RESOLUTION):
+    w, h = _poster_size(orientation, resolution)
+    return make_key(album_name, artist_name, orientation, f"{w}x{h}", BACKGROUND_QUALITY, RENDERER_VERSION)
+
+def _render_and_store(key, album_name, artist_name, orientation, album_id, resolution=DEFAULT_RESOLUTION):
+    poster = _render_poster(album_name, artist_name, orientation, album_id, resolution)
+    if poster:
+        # The lossless master only saves a re-render when another format of the same poster
+        # is asked for, so it's written off the render path (a 4K PNG takes longer than
+        # composing the poster). If the writer is backed up, this one is just skipped.
+        try: _master_queue.put_nowait((key, poster))
+        except queue.Full: pass
+    return poster
+
+_master_queue = queue.Queue(maxsize=4)
+
+def _master_writer():
+    while True:
+        key, poster = _master_queue.get()
+        try:
+            buffer = BytesIO()
+            poster.convert("RGB").save(buffer, format="PNG", compress_level=1) # Lossless, but fast to write
+            poster_cache.put(key, buffer.getvalue())
+        except Exception as e:
+            print(f"Couldn't store poster master: {e}")
+
+threading.Thread(target=_master_writer, name="poster-master-writer", daemon=True).start()
+
+def _render_poster(album_name, artist_name, orientation="Portrait", album_id=None, resolution=DEFAULT_RESOLUTION):
+    assets = fetch_spotify_assets(album_name, artist_name, album_id)
     if not assets: return None
-    
+    return compose_poster(assets, artist_name, orientation, resolution)
+
+# --- ⚡️ SPOTIFY CODE OVERLAY ⚡️ ---
+# The code comes back as white bars on black and is pasted as white-on-transparent. Its
+# alpha used to be built with a Python loop over all 102,400 pixels (a tuple and a sum
+# each) on every render. Now it's one NumPy expression, and the resized overlay is kept
+# per album and height, so after the first render of an album it's a dict lookup.
+CODE_OVERLAY_CACHE_SIZE = 256 # A few KB each
+_code_overlays = OrderedDict() # (album uri, height) -> overlay, LRU order
+_code_overlays_lock = threading.Lock()
+
+def code_alpha_mask(code_img):
+    """White RGBA whose alpha is the mean of each pixel's RGB (so the black background vanishes)."""
+    rgb = np.asarray(code_img.convert("RGBA"), dtype=np.uint16)[..., :3]
+    overlay = np.full(rgb.shape[:2] + (4,), 255, dtype=np.uint8)
+    overlay[..., 3] = rgb.sum(axis=2) // 3
+    return Image.fromarray(overlay, "RGBA")
+
+def get_code_overlay(uri, code_bytes, height):
+    """The album's Spotify code as a `height` px tall overlay (it's its own paste mask)."""
+    key = (uri, height)
+    with _code_overlays_lock:
+        overlay = _code_overlays.get(key)
+        if overlay is not None:
+            _code_overlays.move_to_end(key)
+            return overlay
+
+    if code_bytes: code_img = code_alpha_mask(Image.open(BytesIO(code_bytes)))
+    else: code_img = Image.new('RGBA', (640, 160), (255, 255, 255, 0)) # No code: same space, nothing drawn
+    code_w = int((height / code_img.height) * code_img.width)
+    overlay = code_img.resize((code_w, height))
+
+    with _code_overlays_lock:
+        _code_overlays[key] = overlay
+        while len(_code_overlays) > CODE_OVERLAY_CACHE_SIZE: _code_overlays.popitem(last=False)
+    return overlay
+
+def compose_backdrop(cover_bytes, orientation="Portrait", resolution=DEFAULT_RESOLUTION):
+    """Blurred, dimmed cover background with the framed cover on top: the part of the poster
+    that only needs the cover art. Returns (image, (width, height, padding, cover size))."""
+    scale = resolution / DEFAULT_RESOLUTION
+    def px(value): return round(value * scale)
+
+    if orientation in ["Portrait", "Portrait (Sideways TV)"]:
+        (poster_w, poster_h), padding = _poster_size("Portrait", resolution), px(90)
+        cover_size, blur_radius, dim = poster_w - (padding * 2), px(10), 130
+    else:
+        (poster_w, poster_h), padding = _poster_size("Landscape", resolution), px(80)
+        cover_size, blur_radius, dim = px(800), px(12), 160
+
+    # Cached per album + poster size, at the configured quality (see backdrop.py)
+    poster = background_cache.get(cover_bytes, (poster_w, poster_h), blur_radius, dim)
+    draw = ImageDraw.Draw(poster)
+
+    cover_img = Image.open(BytesIO(cover_bytes)).convert("RGBA")
+    draw.rectangle([padding-px(3), padding-px(3), padding+cover_size+px(2), padding+cover_size+px(2)], fill="black")
+    poster.paste(cover_img.resize((cover_size, cover_size)), (padding, padding))
+    return poster, (poster_w, poster_h, padding, cover_size)
+
+def compose_preview(cover_bytes, orientation="Portrait", resolution=DEFAULT_RESOLUTION):
+    """Phase one of a cold render: just the backdrop, laid out exactly where the finished
+    poster will put it, so the swap only adds text, the code and the colour bar."""
+    poster, _ = compose_backdrop(cover_bytes, orientation, resolution)
+    if orientation == "Portrait (Sideways TV)":
+        poster = poster.rotate(270, expand=True)
+    return poster
+
+def compose_poster(assets, artist_name, orientation="Portrait", resolution=DEFAULT_RESOLUTION):
+    """The Pillow part: an asset record (see fetch_spotify_assets) -> poster image.
+
+    Every size below is in 1080p pixels and goes through px(), so the same layout comes
+    out at any RESOLUTION_TIERS height (1080 = exactly the original 1920x1080 poster).
+    """
+    scale = resolution / DEFAULT_RESOLUTION
+    def px(value): return round(value * scale)
+
     clean_name = assets["clean_name"]
     release_date = assets["release_date"]
     display_tracks = assets["display_tracks"]
     duration_str = assets["duration_str"]
+    palette = assets.get("palette") or extract_palette(assets["cover_bytes"])
 
-    # Rebuild images from cached bytes
-    cover_img = Image.open(BytesIO(assets["cover_bytes"])).convert("RGBA")
-    
-    if assets["code_bytes"]:
-        spotify_code_img = Image.open(BytesIO(assets["code_bytes"])).convert("RGBA")
-        spotify_code_img.putdata([(255, 255, 255, int(sum(item[:3]) / 3)) for item in spotify_code_img.getdata()])
-    else: 
-        spotify_code_img = Image.new('RGBA', (640, 160), (255, 255, 255, 0))
-
-    def get_safe_font(size):
-        font_paths = [
-            "/System/Library/Fonts/Supplemental/Arial Narrow Bold.ttf", 
-            "/System/Library/Fonts/Supplemental/Arial Bold.ttf", 
-            "/Library/Fonts/Arial Bold.ttf", 
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-            "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
-        ]
-        for path in font_paths:
-            try: return ImageFont.truetype(path, size)
-            except IOError: continue
-        return ImageFont.load_default()
+    poster, (poster_w, poster_h, padding, cover_size) = compose_backdrop(assets["cover_bytes"], orientation, resolution)
+    draw = ImageDraw.Draw(poster)
 
     if orientation in ["Portrait", "Portrait (Sideways TV)"]:
-        poster_w, poster_h, padding = 1080, 1920, 90 
-        cover_size = poster_w - (padding * 2)
-        
-        tiny_bg = cover_img.resize((poster_w // 4, poster_h // 4))
-        tiny_bg = tiny_bg.filter(ImageFilter.GaussianBlur(radius=10))
-        bg_img = tiny_bg.resize((poster_w, poster_h), resample=Image.Resampling.BICUBIC)
-        
-        poster = Image.alpha_composite(bg_img, Image.new('RGBA', bg_img.size, (0, 0, 0, 130)))
-        draw = ImageDraw.Draw(poster)
-        
-        draw.rectangle([padding-3, padding-3, padding+cover_size+2, padding+cover_size+2], fill="black")
-        poster.paste(cover_img.resize((cover_size, cover_size)), (padding, padding))
-        
-        code_y = padding + cover_size + 45      
-        code_w = int((90 / spotify_code_img.height) * spotify_code_img.width)
-        poster.paste(spotify_code_img.resize((code_w, 90)), (padding, code_y), spotify_code_img.resize((code_w, 90)))
+        code_y = padding + cover_size + px(45)
+        code_img = get_code_overlay(assets["uri"], assets["code_bytes"], px(90))
+        code_w = code_img.width
+        poster.paste(code_img, (padding, code_y), code_img)
 
         title_size = 30 if len(clean_name) > 30 else (34 if len(clean_name) > 20 else 38)
         artist_size = 40 if len(artist_name) > 35 else (55 if len(artist_name) > 25 else 70)
         
-        max_text_width = (poster_w - padding) - (padding + code_w + 20)
-        new_y_after_artist = draw_wrapped_text(draw, artist_name.upper(), get_safe_font(artist_size), max_text_width, poster_w - padding, code_y - 12, "white", "right")
-        new_y_after_title = draw_wrapped_text(draw, clean_name.upper(), get_safe_font(title_size), max_text_width, poster_w - padding, new_y_after_artist + 5, "white", "right")
+        max_text_width = (poster_w - padding) - (padding + code_w + px(20))
+        new_y_after_artist = draw_wrapped_text(draw, artist_name.upper(), get_safe_font(px(artist_size)), max_text_width, poster_w - padding, code_y - px(12), "white", "right", line_gap=px(10))
+        new_y_after_title = draw_wrapped_text(draw, clean_name.upper(), get_safe_font(px(title_size)), max_text_width, poster_w - padding, new_y_after_artist + px(5), "white", "right", line_gap=px(10))
 
-        track_y_start = new_y_after_title + 60 
-        meta_y, bar_y = poster_h - padding - 45, poster_h - padding + 5
-        
-        available_space = meta_y - track_y_start - 30
-        track_lines = max(1, (len(display_tracks) + 1) // 2)
-        
-        optimal_spacing = available_space // track_lines if track_lines > 0 else 50
-        track_spacing = min(45, optimal_spacing)
+        track_y_start = new_y_after_title + px(60) 
+        meta_y, bar_y = poster_h - padding - px(45), poster_h - padding + px(5)
         
-        if track_spacing < 35:
-            display_tracks = display_tracks[:18]
-            track_lines = max(1, (len(display_tracks) + 1) // 2)
-            track_spacing = min(45, available_space // track_lines) if track_lines > 0 else 45
+        available_space = meta_y - track_y_start - px(30)
+        track_count, track_spacing, track_size = fit_tracks(len(display_tracks), available_space, 2, px(45), px(35), px(22), tight_count=18)
+        display_tracks = display_tracks[:track_count]
 
-        max_col_width = (poster_w - (padding * 2)) // 2 - 20 
-        font_tracks = get_safe_font(22)
+        max_col_width = (poster_w - (padding * 2)) // 2 - px(20) 
+        font_tracks = get_safe_font(track_size)
 
         mid_point = (len(display_tracks) + 1) // 2
         for i, track in enumerate(display_tracks[:mid_point]):
@@ -194,69 +353,52 @@ def create_poster(album_name, artist_name, orientation="Portrait"):
             text = truncate_text(f"{track} .{mid_point+i+1}", font_tracks, max_col_width)
             draw.text((poster_w - padding, track_y_start + (i * track_spacing)), text, font=font_tracks, fill="white", anchor="ra")
 
-        draw.text((padding, meta_y), f"RELEASE DATE: {release_date}", font=get_safe_font(22), fill="#e0e0e0")
-        draw.text((poster_w - padding, meta_y), f"ALBUM DURATION: {duration_str}", font=get_safe_font(22), fill="#e0e0e0", anchor="ra")
+        draw.text((padding, meta_y), f"RELEASE DATE: {release_date}", font=get_safe_font(px(22)), fill="#e0e0e0")
+        draw.text((poster_w - padding, meta_y), f"ALBUM DURATION: {duration_str}", font=get_safe_font(px(22)), fill="#e0e0e0", anchor="ra")
 
         segment_w = cover_size // 4
         for i in range(4):
-            color = cover_img.crop((i * (cover_img.width // 4), 0, (i + 1) * (cover_img.width // 4), cover_img.height)).resize((1, 1), resample=Image.Resampling.LANCZOS).getpixel((0, 0))
-            draw.rectangle([padding + (i * segment_w), bar_y, padding + ((i + 1) * segment_w), bar_y + 20], fill=color)
+            draw.rectangle([padding + (i * segment_w), bar_y, padding + ((i + 1) * segment_w), bar_y + px(20)], fill=palette["bar"][i])
 
         if orientation == "Portrait (Sideways TV)":
             poster = poster.rotate(270, expand=True)
 
     else:
         # --- LANDSCAPE LOGIC ---
-        poster_w, poster_h, padding = 1920, 1080, 80
-        cover_size = 800 
-        
-        tiny_bg = cover_img.resize((poster_w // 4, poster_h // 4))
-        tiny_bg = tiny_bg.filter(ImageFilter.GaussianBlur(radius=12))
-        bg_img = tiny_bg.resize((poster_w, poster_h), resample=Image.Resampling.BICUBIC)
-        
-        poster = Image.alpha_composite(bg_img, Image.new('RGBA', bg_img.size, (0, 0, 0, 160))) 
-        draw = ImageDraw.Draw(poster)
-        
-        draw.rectangle([padding-3, padding-3, padding+cover_size+2, padding+cover_size+2], fill="black")
-        poster.paste(cover_img.resize((cover_size, cover_size)), (padding, padding))
-        
-        text_start_x = padding + cover_size + 80
-        code_w = int((100 / spotify_code_img.height) * spotify_code_img.width)
-        poster.paste(spotify_code_img.resize((code_w, 100)), (text_start_x, padding), spotify_code_img.resize((code_w, 100)))
+        text_start_x = padding + cover_size + px(80)
+        code_img = get_code_overlay(assets["uri"], assets["code_bytes"], px(100))
+        code_w = code_img.width
+        poster.paste(code_img, (text_start_x, padding), code_img)
 
         right_edge_x = poster_w - padding
-        max_title_width = (poster_w - padding) - (text_start_x + code_w + 40)
+        max_title_width = (poster_w - padding) - (text_start_x + code_w + px(40))
         
         artist_size = 70 if len(artist_name) > 25 else 90
         title_size = 40 if len(clean_name) > 30 else 50
         
-        new_y_after_artist = draw_wrapped_text(draw, artist_name.upper(), get_safe_font(artist_size), max_title_width, right_edge_x, padding - 10, "white", "right")
-        new_y_after_title = draw_wrapped_text(draw, clean_name.upper(), get_safe_font(title_size), max_title_width, right_edge_x, new_y_after_artist + 15, "#e0e0e0", "right")
+        new_y_after_artist = draw_wrapped_text(draw, artist_name.upper(), get_safe_font(px(artist_size)), max_title_width, right_edge_x, padding - px(10), "white", "right", line_gap=px(10))
+        new_y_after_title = draw_wrapped_text(draw, clean_name.upper(), get_safe_font(px(title_size)), max_title_width, right_edge_x, new_y_after_artist + px(15), "#e0e0e0", "right", line_gap=px(10))
 
-        track_y_start = new_y_after_title + 70 
+        track_y_start = new_y_after_title + px(70) 
         
-        font_tracks = get_safe_font(24) 
-        meta_y = poster_h - padding - 45
+        meta_y = poster_h - padding - px(45)
+        available_space = meta_y - track_y_start - px(20)
         
         if len(display_tracks) <= 11:
-            track_spacing = 40 
+            # One column; tightens up (instead of running into the meta line) under a long title
+            _, track_spacing, track_size = fit_tracks(len(display_tracks), available_space, 1, px(40), px(30), px(24))
+            font_tracks = get_safe_font(track_size)
             max_track_width = right_edge_x - text_start_x
             for i, track in enumerate(display_tracks):
                 text = truncate_text(f"{track} .{i+1}", font_tracks, max_track_width)
                 draw.text((right_edge_x, track_y_start + (i * track_spacing)), text, font=font_tracks, fill="white", anchor="ra")
         else:
+            track_count, track_spacing, track_size = fit_tracks(len(display_tracks), available_space, 2, px(40), px(30), px(24), tight_count=18)
+            display_tracks = display_tracks[:track_count]
             mid_point = (len(display_tracks) + 1) // 2
-            
-            available_space = meta_y - track_y_start - 20
-            optimal_spacing = available_space // mid_point if mid_point > 0 else 40
-            track_spacing = min(40, optimal_spacing) 
-            
-            if track_spacing < 30:
-                display_tracks = display_tracks[:18]
-                mid_point = (len(display_tracks) + 1) // 2
-                track_spacing = min(40, available_space // mid_point) if mid_point > 0 else 40
+            font_tracks = get_safe_font(track_size)
                 
-            max_col_width = (right_edge_x - text_start_x) // 2 - 30 
+            max_col_width = (right_edge_x - text_start_x) // 2 - px(30) 
             
             for i, track in enumerate(display_tracks[:mid_point]):
                 text = truncate_text(f"{i+1}. {track}", font_tracks, max_col_width)
@@ -266,15 +408,216 @@ def create_poster(album_name, artist_name, orientation="Portrait"):
                 text = truncate_text(f"{track} .{mid_point+i+1}", font_tracks, max_col_width)
                 draw.text((right_edge_x, track_y_start + (i * track_spacing)), text, font=font_tracks, fill="white", anchor="ra")
 
-        draw.text((padding, meta_y), f"RELEASE DATE: {release_date}", font=get_safe_font(22), fill="#cccccc")
-        draw.text((poster_w - padding, meta_y), f"ALBUM DURATION: {duration_str}", font=get_safe_font(22), fill="#cccccc", anchor="ra")
+        draw.text((padding, meta_y), f"RELEASE DATE: {release_date}", font=get_safe_font(px(22)), fill="#cccccc")
+        draw.text((poster_w - padding, meta_y), f"ALBUM DURATION: {duration_str}", font=get_safe_font(px(22)), fill="#cccccc", anchor="ra")
 
-        bar_y = poster_h - padding + 5
+        bar_y = poster_h - padding + px(5)
         bar_width = poster_w - (padding * 2)
         segment_w = bar_width // 4
         
         for i in range(4):
-            color = cover_img.crop((i * (cover_img.width // 4), 0, (i + 1) * (cover_img.width // 4), cover_img.height)).resize((1, 1), resample=Image.Resampling.LANCZOS).getpixel((0, 0))
-            draw.rectangle([padding + (i * segment_w), bar_y, padding + ((i + 1) * segment_w), bar_y + 20], fill=color)
+            draw.rectangle([padding + (i * segment_w), bar_y, padding + ((i + 1) * segment_w), bar_y + px(20)], fill=palette["bar"][i])
+
+    return poster
+
+# Posters on disk are keyed by a hash of the code that draws them, so a change to how they
+# look retires them all - but only that code: resolver, cache or log line edits leave them be.
+# (If compose_poster starts calling something new, add it here.)
+_RENDERER_CODE = (compose_poster, compose_backdrop, _poster_size, get_code_overlay, code_alpha_mask,
+                  draw_wrapped_text, truncate_text, clean_track_title, type(font_registry),
+                  text_layout, backdrop, palette)
+RENDERER_VERSION = hashlib.sha256("".join(inspect.getsource(code) for code in _RENDERER_CODE).encode()).hexdigest()[:12]
+
+
+# --- ⚡️ NEGATIVE CACHE: DON'T HAMMER SPOTIFY FOR SONGS IT CAN'T FIND ⚡️ ---
+# A lookup that fails (no match, an exception, a 429) used to be retried on every tick
+# until the song changed. Now each (track, artist) that fails is left alone for an
+# exponentially growing while, and the screen gets a cover-less poster in the meantime.
+NEGATIVE_BACKOFF_BASE = 30    # seconds after the first failure
+NEGATIVE_BACKOFF_MAX = 3600
+
+class NegativeCache:
+    def __init__(self, base=NEGATIVE_BACKOFF_BASE, cap=NEGATIVE_BACKOFF_MAX):
+        self.base, self.cap = base, cap
+        self._failures = {} # key -> (failure count, retry_at)
+        self._lock = threading.Lock()
+
+    def retry_at(self, key):
+        """When this key may hit Spotify again (0 = now)."""
+        with self._lock:
+            return self._failures.get(key, (0, 0))[1]
+
+    def record_failure(self, key):
+        with self._lock:
+            failures = self._failures.get(key, (0, 0))[0] + 1
+            retry_at = time.time() + min(self.cap, self.base * 2 ** (failures - 1))
+            self._failures[key] = (failures, retry_at)
+            return retry_at
+
+    def record_success(self, key):
+        with self._lock: self._failures.pop(key, None)
+
+negative_cache = NegativeCache()
+
+def create_fallback_poster(track_name, artist_name, orientation="Landscape", resolution=DEFAULT_RESOLUTION):
+    """No Spotify, no downloads: just the song and artist on a dark card."""
+    scale = resolution / DEFAULT_RESOLUTION
+    def px(value): return round(value * scale)
+
+    poster_w, poster_h = _poster_size("Portrait" if orientation in ["Portrait", "Portrait (Sideways TV)"] else "Landscape", resolution)
+    padding = poster_w // 12
+    poster = Image.new('RGBA', (poster_w, poster_h), (12, 12, 16, 255))
+    draw = ImageDraw.Draw(poster)
+
+    # Purple accent bar down the left of the text block, like the brand mark
+    text_x, top_y = padding + px(50), poster_h // 2 - px(120)
+    max_width = poster_w - text_x - padding
+    next_y = draw_wrapped_text(draw, artist_name.upper(), get_safe_font(px(90)), max_width, text_x, top_y, "white", "left", line_gap=px(10))
+    end_y = draw_wrapped_text(draw, clean_track_title(track_name).upper() or track_name.upper(), get_safe_font(px(50)), max_width, text_x, next_y + px(20), "#cccccc", "left", line_gap=px(10))
+    draw.rectangle([padding, top_y, padding + px(12), end_y], fill="#7C3AED")
+    draw.text((poster_w - padding, poster_h - padding), "NOW PLAYING", font=get_safe_font(px(22)), fill="#666666", anchor="rd")
 
+    if orientation == "Portrait (Sideways TV)":
+        poster = poster.rotate(270, expand=True)
     return poster
+
+# ⚡️ STAGE 3: ENCODE ONCE, SERVE BYTES ⚡️
+# Every full rerun used to hand the PIL poster to st.image, which copied it to RGB, shrank
+# it to Streamlit's max content width and JPEG-encoded it again - per session, per rerun.
+# Now each poster is encoded once per output format, kept on disk next to the lossless
+# PNG, and the display hands those exact bytes to the browser.
+#
+# Cheap HDMI sticks on venue Wi-Fi are slow to pull a full-HD JPEG, so a display can ask
+# for a smaller format in its layout record ("format") or get one picked from the link
+# speed its browser reports. `python bench.py formats` shows the size/time trade-offs.
+POSTER_FORMATS = {
+    # name: (Pillow format, mimetype, save options)
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 90}), # What st.image used to re-encode at
+    "jpeg-progressive": ("JPEG", "image/jpeg", {"quality": 85, "progressive": True, "optimize": True}),
+    "jpeg-lite": ("JPEG", "image/jpeg", {"quality": 70, "progressive": True, "optimize": True}),
+    "webp": ("WEBP", "image/webp", {"quality": 82, "method": 4}),
+    "webp-lite": ("WEBP", "image/webp", {"quality": 65, "method": 4}),
+}
+if features.check("avif"): # Only if this Pillow build has an AVIF encoder
+    POSTER_FORMATS["avif"] = ("AVIF", "image/avif", {"quality": 60, "speed": 8})
+DEFAULT_FORMAT = "jpeg"
+SLOW_LINK_MBPS, MEDIUM_LINK_MBPS = 2, 8
+
+
+def choose_format(requested=None, link_mbps=None):
+    """The display's own choice if we can make it, else by link speed, else plain JPEG."""
+    if requested in POSTER_FORMATS: return requested
+    if link_mbps:
+        if link_mbps < SLOW_LINK_MBPS: return "webp-lite"
+        if link_mbps < MEDIUM_LINK_MBPS: return "webp"
+    return DEFAULT_FORMAT
+
+
+@dataclass(frozen=True)
+class EncodedPoster:
+    """A finished poster as the browser gets it."""
+    data: bytes
+    mimetype: str
+    width: int
+    height: int
+    retry_at: float = None # Only on the cover-less fallback: when the real poster is worth another try
+
+
+def encode_poster(poster, fmt=DEFAULT_FORMAT, retry_at=None):
+    pil_format, mimetype, options = POSTER_FORMATS[fmt]
+    buffer = BytesIO()
+    poster.convert("RGB").save(buffer, format=pil_format, **options)
+    return EncodedPoster(buffer.getvalue(), mimetype, poster.width, poster.height, retry_at)
+
+def get_encoded_poster(album_name, artist_name, orientation="Portrait", album_id=None, fmt=DEFAULT_FORMAT, resolution=DEFAULT_RESOLUTION):
+    """create_poster, but as final bytes in the given format. Returns None if the poster can't be made."""
+    pil_format, mimetype, options = POSTER_FORMATS[fmt]
+    key = make_key(_poster_key(album_name, artist_name, orientation, resolution), pil_format, sorted(options.items()))
+    cached = encoded_cache.get(key)
+    if cached:
+        w, h = _poster_size(orientation, resolution)
+        return EncodedPoster(cached, mimetype, w, h)
+    return render_flight.do(key, _encode_and_store, key, album_name, artist_name, orientation, album_id, fmt, resolution)
+
+def _encode_and_store(key, album_name, artist_name, orientation, album_id, fmt, resolution):
+    poster = create_poster(album_name, artist_name, orientation, album_id=album_id, resolution=resolution)
+    if not poster: return None
+    encoded = encode_poster(poster, fmt)
+    encoded_cache.put(key, encoded.data)
+    return encoded
+
+# ⚡️ TWO-PHASE RENDER ⚡️
+# A cold song used to show nothing new until lookups, two downloads, blur and text were
+# all done. Now the moment the cover bytes come off the network, the render worker publishes
+# the backdrop (cover over blur) as a preview, and the finished poster swaps in after.
+# Only on a real download: with the album's assets already on disk the poster is moments
+# away, and a preview there just flashes a bare cover over the screen (a format or
+# resolution change re-renders the same song).
+_preview_hook = threading.local() # Set by render_for_track for the thread doing the render
+
+def _cover_arrived(cover_bytes):
+    hook = getattr(_preview_hook, "fn", None)
+    if hook is None: return
+    _preview_hook.fn = None # Once per render
+    try: hook(cover_bytes)
+    except Exception as e: print(f"Preview failed: {e}")
+
+def _publish_cover_preview(cover_bytes, orientation, resolution):
+    start = time.perf_counter()
+    # Capped at 1080p (the browser scales it up for a few seconds), and plain JPEG: it has to be quick
+    preview = compose_preview(cover_bytes, orientation, min(resolution, DEFAULT_RESOLUTION))
+    publish_preview(encode_poster(preview))
+    elapsed = (time.perf_counter() - start) * 1000
+    with _resolution_lock:
+        _resolution_stats["previews"] += 1
+        _resolution_stats["last_preview_ms"] = round(elapsed, 1)
+        _resolution_stats["max_preview_ms"] = max(_resolution_stats["max_preview_ms"], round(elapsed, 1))
+
+# ⚡️ ONE CALL FOR THE RENDER WORKERS: now playing track -> finished poster ⚡️
+_resolution_stats = {"resolutions": 0, "spotify_calls": 0, "max_calls": 0, "last_calls": 0, "fallbacks": 0,
+                     "previews": 0, "last_preview_ms": 0.0, "max_preview_ms": 0.0}
+_resolution_lock = threading.Lock()
+
+def render_for_track(track_name, artist_name, orientation="Landscape", venue_id=None, fmt=DEFAULT_FORMAT, resolution=DEFAULT_RESOLUTION):
+    """Always returns an EncodedPoster. If it's the cover-less fallback, its retry_at says
+    when the real one is worth trying again."""
+    failure_key = (normalize_track(track_name), normalize_artist(artist_name))
+    retry_at = negative_cache.retry_at(failure_key)
+    poster, calls = None, 0
+
+    if time.time() >= retry_at:
+        calls_before = thread_call_count()
+        # Only fires if we actually get as far as the cover art (not on a finished-poster hit)
+        _preview_hook.fn = lambda cover_bytes: _publish_cover_preview(cover_bytes, orientation, resolution)
+        try:
+            album = resolve_track(track_name, artist_name, venue_id)
+            poster = get_encoded_poster(album["name"], artist_name, orientation, album_id=album["id"], fmt=fmt, resolution=resolution) if album else None
+        except Exception as e:
+            print(f"Poster lookup failed for '{track_name}' by {artist_name}: {e}")
+        finally:
+            _preview_hook.fn = None
+        calls = thread_call_count() - calls_before # 0 when everything was cached, 2 for a brand new album
+
+        if poster: negative_cache.record_success(failure_key)
+        else: retry_at = negative_cache.record_failure(failure_key)
+
+    with _resolution_lock:
+        _resolution_stats["resolutions"] += 1
+        _resolution_stats["spotify_calls"] += calls
+        _resolution_stats["max_calls"] = max(_resolution_stats["max_calls"], calls)
+        _resolution_stats["last_calls"] = calls
+        _resolution_stats["fallbacks"] += 0 if poster else 1
+    if calls: print(f"Resolved '{track_name}' by {artist_name} with {calls} Spotify call(s)")
+
+    if poster is None: poster = fallback_poster(track_name, artist_name, orientation, fmt, resolution, retry_at)
+    return poster
+
+def fallback_poster(track_name, artist_name, orientation="Landscape", fmt=DEFAULT_FORMAT, resolution=DEFAULT_RESOLUTION, retry_at=None):
+    """The cover-less card, encoded and ready to show."""
+    return encode_poster(create_fallback_poster(track_name, artist_name, orientation, resolution), fmt, retry_at)
+
+def get_resolution_stats():
+    with _resolution_lock:
+        stats = dict(_resolution_stats)
+    stats["avg_calls"] = round(stats["spotify_calls"] / stats["resolutions"], 2) if stats["resolutions"] else 0.0
+    return stats
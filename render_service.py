@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+# --- ⚡️ OFF-THREAD POSTER RENDERING ⚡️ ---
+# create_poster can take seconds on a cache miss (Spotify lookups, two downloads, Pillow
+# compositing). Running it inside the listener fragment froze that display: no unpair,
+# subscription or standby checks until it finished. Now the listener drops a job in
+# here, keeps the old poster on screen, and picks the result up on a later tick.
+#
+# Threads rather than processes: most of the time is network I/O and Pillow (which
+# releases the GIL), and the in-memory caches (backgrounds, code overlays, fonts) are
+# shared by every worker in the process.
+#
+# The queue is prioritised (live song > layout flip > warm-up), identical jobs from
+# different displays coalesce into one, and a job nobody is waiting for any more
+# (its display moved on to a newer song) is cancelled before it starts.
+#
+# A job that runs past RENDER_JOB_TIMEOUT is given up on: the listener shows a fallback
+# and the next submission for that key starts a fresh job rather than joining it.
+#
+# A job can also publish a quick preview while it runs (see publish_preview), which the
+# listener shows until the finished poster swaps in.
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+RENDER_MAX_PENDING = int(os.environ.get("RENDER_MAX_PENDING", 8))
+RENDER_JOB_TIMEOUT = float(os.environ.get("RENDER_JOB_TIMEOUT", 30))
+
+PRIORITY_LIVE, PRIORITY_LAYOUT, PRIORITY_WARMUP = 0, 1, 2
+PRIORITY_NAMES = {PRIORITY_LIVE: "live", PRIORITY_LAYOUT: "layout", PRIORITY_WARMUP: "warmup"}
+
+
+class RenderJob:
+    """A handle the listener keeps in session_state between ticks (shared by coalesced callers)."""
+
+    def __init__(self, key, fn, args, kwargs, priority, timeout):
+        self.key = key
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.priority = priority
+        self.timeout = timeout
+        self.owners = set()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self.abandoned = False        # Ran past its timeout: still running, but nobody waits for it any more
+        self.preview = None           # Set mid-render by publish_preview(); shown until the real thing is done
+        self.preview_at = None
+        self._value = None
+        self._error = None
+        self._done = threading.Event()
+
+    @property
+    def expired(self):
+        """Running for longer than its budget. (Time spent queued doesn't count.)"""
+        return self.started_at is not None and not self.done() and time.time() - self.started_at > self.timeout
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self):
+        """The rendered poster, or None if the job failed, was cancelled or isn't finished."""
+        if not self.done() or self.cancelled: return None
+        if self._error is not None:
+            print(f"Render job {self.key} failed: {self._error}")
+            return None
+        return self._value
+
+    def _finish(self, value=None, error=None, cancelled=False):
+        self._value, self._error, self.cancelled = value, error, cancelled
+        self.finished_at = time.time()
+        self._done.set()
+
+
+_current = threading.local() # The job a worker thread is running, for publish_preview()
+
+def publish_preview(value):
+    """Called from inside a job's fn: hands the listener something to show while the job
+    keeps working. A no-op outside a render worker."""
+    job = getattr(_current, "job", None)
+    if job is None or job.done(): return
+    job.preview, job.preview_at = value, time.time()
+    service = getattr(_current, "service", None)
+    if service is not None: service._record_phase("preview", job.preview_at - job.submitted_at)
+
+
+class RenderService:
+    def __init__(self, workers=RENDER_WORKERS, max_pending=RENDER_MAX_PENDING, job_timeout=RENDER_JOB_TIMEOUT):
+        self.max_pending = max_pending
+        self.job_timeout = job_timeout
+        self._heap = []               # (priority, seq, job) - may hold stale entries after a re-prioritise
+        self._seq = itertools.count()
+        self._jobs = {}               # key -> queued or running job, for coalescing
+        self._by_owner = {}           # owner -> job it is currently waiting on
+        self._queued = 0
+        self._running = 0
+        self._cond = threading.Condition()
+        self._counters = {"submitted": 0, "coalesced": 0, "cancelled": 0, "rejected": 0, "completed": 0, "failed": 0, "abandoned": 0}
+        self._waits = {p: [0, 0.0, 0.0] for p in PRIORITY_NAMES} # count, total, max (seconds)
+        self._phases = {"preview": [0, 0.0, 0.0], "full": [0, 0.0, 0.0]} # Submit -> preview / finished poster
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"poster-render-{i}", daemon=True).start()
+
+    @property
+    def pending(self):
+        with self._cond: return self._queued + self._running
+
+    def submit(self, key, fn, *args, priority=PRIORITY_LIVE, owner=None, **kwargs):
+        """Queues fn(*args, **kwargs) under `key`.
+
+        Returns the RenderJob (possibly one already queued for the same key), or None if
+        the queue is full - try again next tick. Submitting a new key for the same `owner`
+        cancels that owner's previous job if it hasn't started and nobody else wants it.
+        """
+        with self._cond:
+            if owner is not None:
+                previous = self._by_owner.get(owner)
+                if previous is not None and previous.key != key:
+                    self._drop_owner(previous, owner)
+
+            job = self._jobs.get(key)
+            if job is not None and job.expired:
+                self._abandon(job) # Don't hand out a job that's already past its budget
+                job = None
+            if job is not None:
+                self._counters["coalesced"] += 1
+                if job.started_at is None and priority < job.priority:
+                    job.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._seq), job))
+            else:
+                if self._queued + self._running >= self.max_pending:
+                    self._counters["rejected"] += 1
+                    return None
+                job = RenderJob(key, fn, args, kwargs, priority, self.job_timeout)
+                self._jobs[key] = job
+                self._queued += 1
+                self._counters["submitted"] += 1
+                heapq.heappush(self._heap, (priority, next(self._seq), job))
+                self._cond.notify()
+
+            if owner is not None:
+                job.owners.add(owner)
+                self._by_owner[owner] = job
+            return job
+
+    def cancel(self, owner):
+        """The owner (a display) no longer wants its current job."""
+        with self._cond:
+            job = self._by_owner.pop(owner, None)
+            if job is not None: self._drop_owner(job, owner)
+
+    def give_up(self, job):
+        """The listener timed out on this job. It stops coalescing new submissions and no
+        longer counts towards max_pending (its thread finishes it in the background)."""
+        with self._cond:
+            if job.expired: self._abandon(job)
+
+    def _abandon(self, job):
+        if job.abandoned: return
+        job.abandoned = True
+        self._running -= 1
+        self._counters["abandoned"] += 1
+        if self._jobs.get(job.key) is job: del self._jobs[job.key]
+        for owner in job.owners:
+            if self._by_owner.get(owner) is job: del self._by_owner[owner]
+
+    def _drop_owner(self, job, owner):
+        job.owners.discard(owner)
+        if self._by_owner.get(owner) is job: del self._by_owner[owner]
+        if not job.owners and job.started_at is None and not job.done():
+            self._jobs.pop(job.key, None)
+            self._queued -= 1
+            self._counters["cancelled"] += 1
+            job._finish(cancelled=True) # Its heap entry is skipped when popped
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    while not self._heap: self._cond.wait()
+                    priority, _, job = heapq.heappop(self._heap)
+                    if job.done() or job.started_at is not None or priority != job.priority:
+                        continue # Cancelled, or a stale entry from a re-prioritise
+                    break
+                job.started_at = time.time()
+                self._queued -= 1
+                self._running += 1
+                wait = self._waits[job.priority]
+                waited = job.started_at - job.submitted_at
+                wait[0] += 1; wait[1] += waited; wait[2] = max(wait[2], waited)
+
+            # A job can't be killed mid-render, but every HTTP call it makes has its own
+            # timeout, so it finishes on its own; the listener just stops waiting for it.
+            _current.job, _current.service = job, self
+            try:
+                value, error = job.fn(*job.args, **job.kwargs), None
+            except Exception as e:
+                value, error = None, e
+            finally:
+                _current.job = None
+
+            with self._cond:
+                if not job.abandoned: self._running -= 1 # Abandoning already gave its slot back
+                self._counters["failed" if error else "completed"] += 1
+                if self._jobs.get(job.key) is job: del self._jobs[job.key]
+                for owner in job.owners:
+                    if self._by_owner.get(owner) is job: del self._by_owner[owner]
+            job._finish(value, error)
+            if error is None: self._record_phase("full", job.finished_at - job.submitted_at)
+
+    def _record_phase(self, phase, seconds):
+        with self._cond:
+            timing = self._phases[phase]
+            timing[0] += 1; timing[1] += seconds; timing[2] = max(timing[2], seconds)
+
+    def stats(self):
+        """Queue depth, outcome counters, queue wait times per priority class, and how long
+        after submission the preview and the finished poster were ready."""
+        with self._cond:
+            stats = dict(self._counters, queued=self._queued, running=self._running)
+            timings = {f"{PRIORITY_NAMES[p]}_wait": t for p, t in self._waits.items()}
+            timings.update((f"{phase}_ready", t) for phase, t in self._phases.items())
+            for name, (count, total, longest) in timings.items():
+                stats[f"{name}_ms_avg"] = round(total / count * 1000, 1) if count else 0.0
+                stats[f"{name}_ms_max"] = round(longest * 1000, 1)
+            return stats
+
+
+render_service = RenderService()
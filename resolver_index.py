@@ -0,0 +1,127 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# --- ⚡️ TRACK -> ALBUM INDEX (persistent, fuzzy) ⚡️ ---
+# The recogniser hands us "Wonderwall", "Wonderwall - Remastered" and "WONDERWALL (feat. X)"
+# for the same song, and an exact-string cache missed on every variant and went back to
+# Spotify. We normalise the track/artist the way the poster cleans titles, keep
+# normalised key -> Spotify album in a local SQLite file (survives restarts), and on an
+# exact miss try a close match among the same artist's known tracks.
+#
+# "Close" is deliberately narrow: the same words once version noise ("live", "mono",
+# "2011 mix" ...) and spacing are taken out, and exactly the same numbers. Plain string
+# similarity happily matched "symphony no 5" to "symphony no 6" and "love song" to
+# "love songs". A close match is also only provisional - the real search still runs in
+# the background and its answer is stored under the track's own key.
+
+RESOLVER_DB = os.environ.get("RESOLVER_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".resolver_index.sqlite3"))
+NOISE_WORDS = frozenset({"remaster", "remastered", "version", "mono", "stereo", "mix", "edit", "radio",
+                         "single", "album", "explicit", "clean", "live", "acoustic", "bonus", "track"})
+
+_FEAT = re.compile(r"\s+(feat\.?|ft\.?|featuring)\s+.*$")
+_BRACKETS = re.compile(r"[\(\[].*?[\)\]]")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_NUMBER = re.compile(r"\d+")
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", str(text))
+    return "".join(c for c in text if not unicodedata.combining(c)).casefold()
+
+def normalize_track(name):
+    """'WONDERWALL (feat. X)', 'Wonderwall - Remastered 2014' -> 'wonderwall', '[Untitled]' -> 'untitled'"""
+    folded = _fold(name)
+    name = _FEAT.sub("", _BRACKETS.sub("", folded).split(" - ")[0])
+    key = " ".join(_PUNCTUATION.sub(" ", name).split())
+    # A title that's nothing but brackets would otherwise collide with every other one
+    return key or " ".join(_PUNCTUATION.sub(" ", folded).split())
+
+def normalize_artist(name):
+    """'Oasis feat. Someone', 'OASIS' -> 'oasis'"""
+    name = _FEAT.sub("", _BRACKETS.sub("", _fold(name)))
+    return " ".join(_PUNCTUATION.sub(" ", name).split())
+
+def _core(track_key):
+    """What's left of a normalised title for close matching: (words minus noise, no spaces), numbers."""
+    words = [w for w in track_key.split() if w not in NOISE_WORDS and not w.isdigit()]
+    return "".join(words), tuple(_NUMBER.findall(track_key))
+
+
+class ResolverIndex:
+    def __init__(self, path=RESOLVER_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._venue_stats = {} # venue -> {"hits", "fuzzy_hits", "misses"}
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL") # Several worker processes can share the file
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS resolutions (
+                    track_key TEXT NOT NULL,
+                    artist_key TEXT NOT NULL,
+                    album_id TEXT NOT NULL,
+                    album_name TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (track_key, artist_key)
+                )""")
+        return self._conn
+
+    def _count(self, venue_id, outcome):
+        counts = self._venue_stats.setdefault(venue_id or "unknown", {"hits": 0, "fuzzy_hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def lookup(self, track_name, artist_name, venue_id=None):
+        """Returns {"id", "name"} for a known album, or None (go ask Spotify).
+        A close (not exact) match also has "fuzzy": True."""
+        track_key, artist_key = normalize_track(track_name), normalize_artist(artist_name)
+        if not track_key or not artist_key: return None # Nothing to key on: always ask Spotify
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute(
+                    "SELECT album_id, album_name FROM resolutions WHERE track_key = ? AND artist_key = ?",
+                    (track_key, artist_key)).fetchone()
+                if row:
+                    self._count(venue_id, "hits")
+                    return {"id": row[0], "name": row[1]}
+
+                core = _core(track_key)
+                for known_key, album_id, album_name in db.execute(
+                        "SELECT track_key, album_id, album_name FROM resolutions WHERE artist_key = ?", (artist_key,)):
+                    if core[0] and _core(known_key) == core:
+                        self._count(venue_id, "fuzzy_hits")
+                        return {"id": album_id, "name": album_name, "fuzzy": True}
+                self._count(venue_id, "misses")
+        except sqlite3.Error as e:
+            print(f"Resolver index lookup failed: {e}")
+        return None
+
+    def remember(self, track_name, artist_name, album):
+        if not normalize_track(track_name) or not normalize_artist(artist_name): return
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?)",
+                    (normalize_track(track_name), normalize_artist(artist_name), album["id"], album["name"], time.time()))
+                db.commit()
+        except sqlite3.Error as e:
+            print(f"Resolver index write failed: {e}")
+
+    def stats(self, venue_id=None):
+        """Hit rate per venue (or for just one venue)."""
+        with self._lock:
+            venues = {v: dict(c) for v, c in self._venue_stats.items() if venue_id is None or v == venue_id}
+        for counts in venues.values():
+            total = counts["hits"] + counts["fuzzy_hits"] + counts["misses"]
+            counts["hit_rate"] = round((counts["hits"] + counts["fuzzy_hits"]) / total, 3) if total else 0.0
+        return venues
+
+
+resolver_index = ResolverIndex()
@@ -0,0 +1,61 @@
+import threading
+
+# --- ⚡️ SINGLE-FLIGHT: ONE COMPUTATION PER KEY, HOWEVER MANY ASK ⚡️ ---
+# When a venue with eight TVs gets a new song, all eight sessions miss the caches on the
+# same tick. st.cache_data doesn't stop concurrent misses, so each did the full Spotify
+# lookup + download + render. Now the first caller for a key does the work and everyone
+# else who asks for the same key while it's in flight waits and shares the result
+# (or the exception).
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = self.deduplicated = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.deduplicated += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None: raise call.error
+            return call.value
+
+        try:
+            call.value = fn(*args, **kwargs)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock: del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"executed": self.executed, "deduplicated": self.deduplicated, "in_flight": len(self._calls)}
+
+
+# One group per pipeline stage
+resolve_flight = SingleFlight("resolve")
+fetch_flight = SingleFlight("fetch")
+render_flight = SingleFlight("render")
+
+def get_singleflight_stats():
+    return {group.name: group.stats() for group in (resolve_flight, fetch_flight, render_flight)}
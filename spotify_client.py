@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+import spotipy
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+import streamlit as st
+
+from http_utils import get_session, TIMEOUTS
+
+# --- SECURE CREDENTIAL FETCHER ---
+def get_cred(key):
+    if key in os.environ:
+        return os.environ[key]
+    try:
+        return st.secrets[key]
+    except Exception:
+        return None
+
+# --- ⚡️ ONE SPOTIFY CLIENT FOR THE WHOLE PROCESS ⚡️ ---
+# Building spotipy.Spotify(auth_manager=SpotifyClientCredentials(...)) per lookup meant a
+# fresh client-credentials exchange and a fresh HTTP session for every new song. Now every
+# thread and session shares one client, one in-memory token (renewed a couple of minutes
+# before it expires, by exactly one thread) and the pooled connections from http_utils.
+
+TOKEN_REFRESH_MARGIN = 120 # seconds before expiry
+
+
+class _SharedClientCredentials(SpotifyClientCredentials):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._token_lock = threading.Lock()
+        self.token_refreshes = 0
+        self.last_refresh_ms = None
+
+    def get_access_token(self, as_dict=False, check_cache=True):
+        with self._token_lock: # Only one thread renews, the rest wait and reuse its token
+            token_info = self.cache_handler.get_cached_token()
+            if not (check_cache and token_info and token_info["expires_at"] - time.time() > TOKEN_REFRESH_MARGIN):
+                start = time.perf_counter()
+                token_info = self._add_custom_values_to_token_info(self._request_access_token())
+                self.cache_handler.save_token_to_cache(token_info)
+                self.token_refreshes += 1
+                self.last_refresh_ms = (time.perf_counter() - start) * 1000
+        return token_info if as_dict else token_info["access_token"]
+
+
+_thread_calls = threading.local() # Per-thread call counter, so a render can count its own calls
+
+def thread_call_count():
+    """Spotify API calls made so far by the current thread."""
+    return getattr(_thread_calls, "count", 0)
+
+
+class _InstrumentedSpotify(spotipy.Spotify):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.calls = self.errors = 0
+        self.total_ms = self.max_ms = 0.0
+
+    def _internal_call(self, method, url, payload, params):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = super()._internal_call(method, url, payload, params)
+            ok = True
+            return result
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            _thread_calls.count = thread_call_count() + 1
+            with self._stats_lock:
+                self.calls += 1
+                self.errors += 0 if ok else 1
+                self.total_ms += elapsed
+                self.max_ms = max(self.max_ms, elapsed)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "calls": self.calls, "errors": self.errors,
+                "avg_ms": round(self.total_ms / self.calls, 1) if self.calls else 0.0,
+                "max_ms": round(self.max_ms, 1),
+                "token_refreshes": self.auth_manager.token_refreshes,
+                "last_token_refresh_ms": round(self.auth_manager.last_refresh_ms or 0, 1),
+            }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_spotify():
+    """The shared, thread-safe Spotify client (built on first use)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            auth = _SharedClientCredentials(
+                client_id=get_cred("SPOTIPY_CLIENT_ID"), client_secret=get_cred("SPOTIPY_CLIENT_SECRET"),
+                cache_handler=MemoryCacheHandler(), # Not the default .cache file in the working directory
+                requests_session=get_session("https://accounts.spotify.com"), requests_timeout=TIMEOUTS["spotify_api"],
+            )
+            _client = _InstrumentedSpotify(
+                auth_manager=auth,
+                requests_session=get_session("https://api.spotify.com"), requests_timeout=TIMEOUTS["spotify_api"],
+            )
+        return _client
+
+def get_spotify_stats():
+    return _client.stats() if _client is not None else {}
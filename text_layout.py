@@ -0,0 +1,125 @@
+# --- ⚡️ TEXT LAYOUT ⚡️ ---
+# Truncating a track title used to chop one character at a time and re-measure the whole
+# string with font.getlength (O(n²) per line, up to 22 lines), and wrapping re-measured
+# the growing line for every word. Now each font gets a measurer that caches per-glyph
+# advances and kerning pairs, so a string's width is a sum of dict lookups (and exactly
+# what getlength would say: with Pillow's basic layout a width is the glyph advances
+# plus the kerning of each adjacent pair). Truncation is a binary search over prefix
+# widths, and the track list is fitted in one pass.
+
+ELLIPSIS = "..."
+
+
+class TextMeasurer:
+    def __init__(self, font):
+        self.font = font
+        self._advances = {} # char -> advance width
+        self._kerning = {}  # (char, char) -> adjustment
+        self._cap_height = None
+
+    def advance(self, char):
+        width = self._advances.get(char)
+        if width is None: width = self._advances[char] = self.font.getlength(char)
+        return width
+
+    def kern(self, left, right):
+        pair = (left, right)
+        adjust = self._kerning.get(pair)
+        if adjust is None:
+            adjust = self._kerning[pair] = self.font.getlength(left + right) - self.advance(left) - self.advance(right)
+        return adjust
+
+    def width(self, text):
+        if not text: return 0.0
+        total = self.advance(text[0])
+        for left, right in zip(text, text[1:]):
+            total += self.advance(right) + self.kern(left, right)
+        return total
+
+    def joined_width(self, left_text, left_width, right_text, right_width):
+        """width(left_text + right_text) from the two halves' widths."""
+        if not left_text or not right_text: return left_width + right_width
+        return left_width + right_width + self.kern(left_text[-1], right_text[0])
+
+    def prefix_widths(self, text):
+        """[width(text[:0]), width(text[:1]), ... width(text)]"""
+        widths, total = [0.0], 0.0
+        for i, char in enumerate(text):
+            total += self.advance(char) + (self.kern(text[i - 1], char) if i else 0.0)
+            widths.append(total)
+        return widths
+
+    @property
+    def cap_height(self):
+        if self._cap_height is None: self._cap_height = self.font.getbbox("A")[3]
+        return self._cap_height
+
+
+_measurers = {} # font -> TextMeasurer (fonts come from the registry, so they live as long as the process)
+
+def measurer_for(font):
+    measurer = _measurers.get(font)
+    if measurer is None: measurer = _measurers[font] = TextMeasurer(font)
+    return measurer
+
+
+def truncate(text, font, max_width):
+    """The longest prefix + '...' that fits (same result as the old one-char-at-a-time loop)."""
+    measure = measurer_for(font)
+    prefixes = measure.prefix_widths(text)
+    if prefixes[-1] <= max_width: return text
+
+    ellipsis_width = measure.width(ELLIPSIS)
+    def with_ellipsis(k): # width(text[:k] + "...")
+        return measure.joined_width(text[:k], prefixes[k], ELLIPSIS, ellipsis_width)
+
+    # Widths only grow with k, so binary search for the last prefix that still fits
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if with_ellipsis(mid) <= max_width: lo = mid
+        else: hi = mid - 1
+    return text[:lo].strip() + ELLIPSIS
+
+def wrap(text, font, max_width):
+    """Greedy word wrap -> list of lines. Each word is measured once."""
+    words = text.split()
+    if not words: return []
+    measure = measurer_for(font)
+    space = measure.advance(" ")
+    lines, line, line_width = [], words[0], measure.width(words[0])
+    for word in words[1:]:
+        word_width = measure.width(word)
+        # width(line + " " + word), from the parts
+        candidate = line_width + measure.kern(line[-1], " ") + space + measure.kern(" ", word[0]) + word_width
+        if candidate <= max_width:
+            line, line_width = line + " " + word, candidate
+        else:
+            lines.append(line)
+            line, line_width = word, word_width
+    lines.append(line)
+    return lines
+
+
+def fit_tracks(count, available, columns, max_spacing, min_spacing, font_size, tight_count=None):
+    """One pass over the track list's layout: returns (tracks shown, line spacing, font size).
+
+    Spacing is as generous as max_spacing allows. If that drops below min_spacing, the list
+    is cut to tight_count tracks; if it's still too tight the font shrinks with the spacing
+    (down to two thirds of its size), and past that only the lines that fit are shown.
+    """
+    def spacing_for(n):
+        lines = max(1, -(-n // columns))
+        return min(max_spacing, available // lines)
+
+    spacing = spacing_for(count)
+    if spacing < min_spacing and tight_count is not None and count > tight_count:
+        count = tight_count
+        spacing = spacing_for(count)
+    if spacing >= min_spacing: return count, spacing, font_size
+
+    smallest = font_size * 2 // 3
+    shrunk = font_size * max(spacing, 0) // min_spacing
+    if shrunk >= smallest: return count, spacing, shrunk
+    spacing = min_spacing * smallest // font_size
+    return min(count, max(0, available // spacing) * columns), spacing, smallest
@@ -0,0 +1,216 @@
+import threading
+import time
+
+from cloud_utils import (
+    DisplaySnapshot, VenueStream, make_display_snapshot, read_venue_displays, POLL_DEFAULTS,
+    check_subscription_status, get_venue_settings, get_venue_polling, get_current_song_from_cloud, invalidate_cloud_cache
+)
+from http_utils import thread_request_count
+
+# --- ⚡️ ONE POLLER PER VENUE, NOT PER SCREEN ⚡️ ---
+# Every browser session ran its own listener with its own Firebase reads, so a pub with
+# ten TVs made ten times the requests of a pub with one. Now the first display of a venue
+# starts a hub for it in this process: one now_playing stream, and one poll thread that
+# reads the plan, the settings and EVERY display node (pairing + layout) in a single read.
+# Sessions just touch the hub each tick and read their slice out of memory.
+#
+# Streamlit doesn't tell us when a session goes away, so displays hold a lease that each
+# touch() renews. When the last lease runs out the hub shuts itself (and its stream) down.
+#
+# ⚡️ ADAPTIVE CADENCE: polling the same nodes every second at 4am in weather standby was
+# pure waste. The hub polls in three tiers - "fast" for a while after anything changes,
+# "steady" during normal playback and "standby" once every screen in the venue is showing
+# the weather. Any change (a push, a layout flip, a new setting) snaps it back to fast.
+# Venues can tune the tiers under settings/polling (see cloud_utils.POLL_DEFAULTS).
+
+HUB_LEASE = 30 # seconds a display stays registered without touching the hub
+
+
+class VenueHub:
+    def __init__(self, venue_id, lease=HUB_LEASE):
+        self.venue_id = venue_id
+        self.lease = lease
+        self.stream = VenueStream(venue_id)
+        self.version = 0            # Bumped on any change: now playing, plan, settings or a display
+        self.polls = self.errors = 0
+        self._requests = 0
+        self.polling = dict(POLL_DEFAULTS)
+        self.tier = "fast"
+        self._last_change = time.time()
+        self._tier_seconds = {"fast": 0.0, "steady": 0.0, "standby": 0.0}
+        self._display_seconds = 0.0 # Sum over time of registered displays, for requests per display-hour
+        self._wake = threading.Event()
+        self._state = None          # (displays, is_pro, settings) from the last good poll
+        self._now_playing = None    # Only polled until the stream has data of its own
+        self._missing = set()       # Displays a fresh read confirmed are gone
+        self._leases = {}           # display_id -> last touch
+        self._standby = {}          # display_id -> showing the weather?
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._polled = threading.Condition(self._lock) # Notified after every poll, good or bad
+        self._ready = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.stream.subscribe(lambda *_: self._changed())
+
+    def touch(self, display_id, standby=False):
+        """Registers (or keeps alive) a display. False if the hub already shut down - get a new one."""
+        with self._lock:
+            if self._stopped: return False
+            if display_id not in self._leases and not self._knows(display_id):
+                self._wake.set() # A display we've never seen (just paired?) - poll for it now
+            self._leases[display_id] = time.time()
+            if self._standby.get(display_id) and not standby: self._wake.set() # Woke up - stop dozing
+            self._standby[display_id] = standby
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"venue-hub-{self.venue_id}", daemon=True)
+                self._thread.start()
+                self.stream.start()
+        return True
+
+    def release(self, display_id):
+        with self._lock:
+            self._leases.pop(display_id, None)
+            self._standby.pop(display_id, None)
+            self._missing.discard(display_id) # If it pairs again, check afresh
+
+    def subscribe(self, callback):
+        """Calls callback(hub) whenever anything for the venue changes. Returns an unsubscribe function."""
+        with self._lock: self._subscribers.append(callback)
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers: self._subscribers.remove(callback)
+        return unsubscribe
+
+    def snapshot(self, display_id, wait=2.0):
+        """This display's DisplaySnapshot, straight from memory (waits for the very first poll).
+
+        A display that isn't in our copy of the display list yet only counts as unpaired once
+        a poll has double-checked it (see _poll_once) - until then it may just be newly paired.
+        """
+        self._ready.wait(wait)
+        with self._lock:
+            if self._state is None: return DisplaySnapshot()
+            if not self._knows(display_id):
+                polls = self.polls + self.errors
+                self._polled.wait_for(lambda: self._knows(display_id) or self.polls + self.errors > polls, wait)
+            displays, is_pro, settings = self._state
+            now_playing = self._now_playing or (None, None, 0)
+            display = displays.get(display_id)
+            if display is None and display_id not in self._missing: display = {} # Not confirmed gone: still paired
+        snapshot = make_display_snapshot(display, is_pro, settings, now_playing)
+        return self.stream.apply_to(snapshot)
+
+    def stats(self):
+        """Includes upstream requests per display-hour: the number the cadence tiers are there to shrink."""
+        with self._lock:
+            requests = self._requests + self.stream.requests
+            display_hours = self._display_seconds / 3600
+            return {"displays": len(self._leases), "polls": self.polls, "errors": self.errors,
+                    "version": self.version, "stream_live": self.stream.live,
+                    "tier": self.tier, "tier_seconds": {t: round(s) for t, s in self._tier_seconds.items()},
+                    "requests": requests,
+                    "requests_per_display_hour": round(requests / display_hours, 1) if display_hours else 0.0}
+
+    # --- internals ---
+    def _knows(self, display_id):
+        """In the last display list, or confirmed missing from it. Call with the lock held."""
+        return self._state is not None and (display_id in self._state[0] or display_id in self._missing)
+
+    def _changed(self):
+        with self._lock:
+            self.version += 1
+            self._last_change = time.time()
+            subscribers = list(self._subscribers)
+        self._wake.set() # Snap back to the fast tier right away
+        for callback in subscribers:
+            try: callback(self)
+            except Exception as e: print(f"Hub subscriber failed: {e}")
+
+    def _pick_tier(self, now):
+        if now - self._last_change < self.polling["fast_window"]: return "fast"
+        if self._standby and all(self._standby.get(d) for d in self._leases): return "standby"
+        return "steady"
+
+    def _poll_once(self, interval):
+        try:
+            # The display list is only as fresh as the current tier asks for
+            displays = read_venue_displays(self.venue_id, ttl=interval)
+            with self._lock: leased = set(self._leases)
+            # A display that was paired after our cached copy was taken would look unpaired
+            # (and get sent back to the pairing screen), so double-check newcomers once.
+            unconfirmed = leased - set(displays) - self._missing
+            if unconfirmed:
+                for display_id in unconfirmed: invalidate_cloud_cache(self.venue_id, display_id)
+                displays = read_venue_displays(self.venue_id, ttl=interval)
+            missing = leased - set(displays)
+
+            def or_last(read, slot):
+                # One failed read mustn't switch every screen in the venue to "subscription ended"
+                # (or London weather and a 5 minute timeout): keep what the last good poll said
+                try: return read(self.venue_id, strict=True)
+                except Exception:
+                    if self._state is None: raise
+                    return self._state[slot]
+            state = (displays, or_last(check_subscription_status, 1), or_last(get_venue_settings, 2))
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                self._polled.notify_all()
+            print(f"Venue hub {self.venue_id} poll failed: {e}")
+            return # Keep serving the last good state
+
+        now_playing = None
+        if not self.stream.has_data():
+            try: now_playing = get_current_song_from_cloud(self.venue_id, strict=True)
+            except Exception: now_playing = self._now_playing # A failed read isn't "nothing playing"
+        try: polling = get_venue_polling(self.venue_id, strict=True) # Same cached settings node, no extra read
+        except Exception: polling = self.polling
+        with self._lock:
+            self.polling = polling
+            self.polls += 1
+            changed = state != self._state or now_playing != self._now_playing
+            self._state, self._now_playing, self._missing = state, now_playing, missing
+            self._polled.notify_all()
+        self._ready.set()
+        if changed: self._changed()
+
+    def _run(self):
+        last = time.time()
+        while True:
+            with self._lock:
+                now = time.time()
+                self._display_seconds += len(self._leases) * (now - last)
+                self._tier_seconds[self.tier] += now - last
+                last = now
+                cutoff = now - self.lease
+                self._leases = {d: t for d, t in self._leases.items() if t >= cutoff}
+                self._standby = {d: s for d, s in self._standby.items() if d in self._leases}
+                if not self._leases:
+                    self._stopped = True
+                    break
+                self.tier = self._pick_tier(now)
+                interval = self.polling[self.tier]
+            self.stream.poll_interval = interval # Its fallback polling (stream down) follows the tier too
+            self._wake.clear()
+            self._poll_once(interval)
+            self._requests = thread_request_count() # This thread only ever polls for this venue
+            self._wake.wait(interval)
+        self.stream.stop()
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+def get_venue_hub(venue_id, display_id, standby=False):
+    """The venue's shared hub, with this display registered on it."""
+    with _hubs_lock:
+        hub = _hubs.get(venue_id)
+        if hub is None or not hub.touch(display_id, standby):
+            hub = _hubs[venue_id] = VenueHub(venue_id)
+            hub.touch(display_id, standby)
+        return hub
+
+def get_hub_stats():
+    with _hubs_lock: hubs = dict(_hubs)
+    return {venue_id: hub.stats() for venue_id, hub in hubs.items()}
@@ -1,6 +1,6 @@
 import streamlit as st
 import streamlit.components.v1 as components
-import requests
+from http_utils import http_get
 from datetime import datetime
 
 # --- FREE & FAST WEATHER CACHE ---
@@ -9,7 +9,7 @@ from datetime import datetime
 def get_weather(city):
     try:
         # Using wttr.in as it is a highly reliable, free, keyless API
-        res = requests.get(f"https://wttr.in/{city}?format=j1", timeout=3)
+        res = http_get(f"https://wttr.in/{city}?format=j1", budget="weather")
         data = res.json()
         temp = data['current_condition'][0]['temp_C']
         desc = data['current_condition'][0]['weatherDesc'][0]['value']